@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+# Cosine similarity a new question needs with a cached one to reuse its answer
+SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_SIZE", "10000"))
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL", "600"))
+# Answers kept per user; the oldest is dropped first
+MAX_ENTRIES_PER_USER = int(os.getenv("ANSWER_CACHE_PER_USER", "32"))
+
+
+class SemanticAnswerCache:
+    """
+    Chat answers keyed by user and question embedding.
+
+    A lookup compares the question's embedding with the ones cached for
+    the same user and returns the closest answer if its cosine similarity
+    is at least 'threshold' and it was stored under the same 'version'
+    (the user's data and catalog versions), so re-ingested data is never
+    answered from the cache. Entries expire after 'ttl' seconds and the
+    least recently used are evicted beyond 'maxsize'. Thread-safe; keeps
+    hit/miss/eviction counters like TTLCache.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, maxsize: int = MAX_ENTRIES,
+                 ttl: float = TTL_SECONDS, max_per_user: int = MAX_ENTRIES_PER_USER):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        # user -> (unit question vectors, [(entry id, expires, version, answer)]), rows aligned
+        self._users: Dict[str, Tuple[np.ndarray, list]] = {}
+        # entry id -> user, in LRU order across all users
+        self._lru: "OrderedDict[int, str]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, user_id: str, rows) -> None:
+        """Remove rows of one user's entries; caller holds the lock."""
+        vectors, entries = self._users[user_id]
+        rows = set(rows)
+        for row in rows:
+            self._lru.pop(entries[row][0], None)
+        keep = [row for row in range(len(entries)) if row not in rows]
+        if keep:
+            self._users[user_id] = (vectors[keep], [entries[row] for row in keep])
+        else:
+            del self._users[user_id]
+
+    def get(self, user_id: str, embedding, version: Hashable) -> Optional[Any]:
+        query = self._unit(embedding)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is not None:
+                expired = [row for row, (_, expires, _, _) in enumerate(bucket[1]) if expires <= now]
+                if expired:
+                    self._drop(user_id, expired)
+                    bucket = self._users.get(user_id)
+            if bucket is not None:
+                vectors, entries = bucket
+                similarities = vectors @ query
+                for row in np.argsort(-similarities):
+                    if similarities[row] < self.threshold:
+                        break
+                    entry_id, _, entry_version, answer = entries[row]
+                    if entry_version == version:
+                        self._lru.move_to_end(entry_id)
+                        self.hits += 1
+                        return answer
+            self.misses += 1
+            return None
+
+    def set(self, user_id: str, embedding, version: Hashable, answer: Any) -> None:
+        vector = self._unit(embedding)
+        with self._lock:
+            if user_id in self._users:
+                vectors, entries = self._users[user_id]
+                # answers stored under an older version can never be served again
+                stale = [row for row, entry in enumerate(entries) if entry[2] != version]
+                if len(entries) - len(stale) >= self.max_per_user:
+                    stale.append(next(row for row in range(len(entries)) if row not in stale))
+                if stale:
+                    self._drop(user_id, stale)
+            entry = (self._next_id, time.monotonic() + self.ttl, version, answer)
+            self._lru[self._next_id] = user_id
+            self._next_id += 1
+            vectors, entries = self._users.get(user_id, (np.empty((0, len(vector)), dtype=np.float32), []))
+            self._users[user_id] = (np.vstack([vectors, vector[None, :]]), entries + [entry])
+            while len(self._lru) > self.maxsize:
+                entry_id, oldest_user = next(iter(self._lru.items()))
+                rows = [row for row, entry in enumerate(self._users[oldest_user][1]) if entry[0] == entry_id]
+                self._drop(oldest_user, rows)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            if user_id in self._users:
+                self._drop(user_id, range(len(self._users[user_id][1])))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._users.clear()
+            self._lru.clear()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._lru),
+            "users": len(self._users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
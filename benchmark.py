@@ -0,0 +1,388 @@
+"""
+End-to-end benchmark for ingestion and retrieval.
+
+For each index size it generates a seeded dataset with data_use_case_1.py,
+ingests it with embedding.py into a fresh working directory, then measures
+query_by_text, query_by_metadata, get_transaction_recommendations and
+chat latency there. Chat uses the offline fake LLM by default, so the
+report can split request time into our own overhead and model time;
+the per-stage histograms from metrics.py show where the overhead goes.
+Every phase runs in its own process so that its peak RSS can be measured
+separately. Results are written as JSON for comparing runs.
+
+    python benchmark.py --sizes 1000 10000 100000 1000000 --output benchmark_results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+TEXT_QUERIES = [
+    "groceries", "dining out", "electronics purchase", "train tickets", "cashback offer",
+    "low risk fixed deposit", "aggressive growth strategy", "Swiggy", "Amazon", "monthly subscription",
+]
+METADATA_FILTERS = [
+    {"record_type": "offer"},
+    {"record_type": "investment_strategy"},
+    {"record_type": "financial_asset"},
+    {"$and": [{"record_type": "transaction"}, {"category": "groceries"}]},
+    {"$and": [{"record_type": "transaction"}, {"category": "travel"}]},
+]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of 'values' (q in 0..100)."""
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(latencies):
+    if not latencies:
+        return {"n": 0}
+    return {
+        "n": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def time_calls(fn, args_list, warmup=3):
+    """Call fn(*args) for each entry, returning per-call latencies in seconds."""
+    for args in args_list[:warmup]:
+        fn(*args)
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run_measured(cmd, cwd, log_path):
+    """Run 'cmd' to completion; return (wall seconds, peak RSS in MB, output)."""
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    with open(log_path) as log:
+        output = log.read()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed with exit code {proc.returncode}:\n{output[-2000:]}")
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024.0, output
+
+
+def measure_chat(assistant, questions):
+    """Time chat end to end, splitting out model time when the backend reports it."""
+    latencies = []
+    model_before = assistant.model_seconds()
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        assistant.chat(question, session_id=f"bench-{i}")  # a new session, so every turn is the same size
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies)
+    if model_before is not None and latencies:
+        model = assistant.model_seconds() - model_before
+        result["model_share"] = model / sum(latencies)
+        result["overhead_mean_ms"] = (sum(latencies) - model) / len(latencies) * 1000
+    result["context_compression"] = assistant.context_compressor.stats()
+    return result
+
+
+def measure_answer_cache(assistant, questions):
+    """Ask every question twice; the repeats should be answered from the semantic answer cache."""
+    assistant.answer_cache.clear()
+    for i, question in enumerate(questions):
+        assistant.chat(question, session_id=f"bench-cache-{i}")
+    latencies = []
+    for i, question in enumerate(questions):
+        start = time.perf_counter()
+        assistant.chat(question, session_id=f"bench-cache-{i}")
+        latencies.append(time.perf_counter() - start)
+    result = summarize(latencies)
+    result["cache"] = assistant.answer_cache.stats()
+    return result
+
+
+def measure_long_session(assistant, questions, turns=40):
+    """
+    Hold one conversation for 'turns' turns; with bounded history the
+    last turns should cost about as much as the first ones.
+    """
+    latencies = []
+    history_tokens = []
+    session_id = "bench-long-session"
+    for i in range(turns):
+        history_tokens.append(assistant.memory.tokens(session_id))
+        start = time.perf_counter()
+        assistant.chat(questions[i % len(questions)], session_id=session_id)
+        latencies.append(time.perf_counter() - start)
+    assistant.memory.clear(session_id)
+    quarter = max(1, turns // 4)
+    return {
+        "turns": turns,
+        "first_turns": summarize(latencies[:quarter]),
+        "last_turns": summarize(latencies[-quarter:]),
+        "max_history_tokens": max(history_tokens),
+        "memory": assistant.memory.stats(),
+    }
+
+
+def measure_concurrent_chat(assistant, questions, concurrency):
+    """Serve 'concurrency' achat calls at a time from one event loop."""
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i, question):
+            async with semaphore:
+                await assistant.achat(question, session_id=f"bench-concurrent-{i}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i, question) for i, question in enumerate(questions)))
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(run())
+    return {
+        "concurrency": concurrency,
+        "requests": len(questions),
+        "seconds": elapsed,
+        "requests_per_sec": len(questions) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def measure_compact(query_collection, resources, texts, k=10):
+    """
+    Latency of compact-index search, and its recall@k against an exact
+    float32 scan, with and without re-ranking; Chroma's HNSW recall is
+    reported alongside for comparison.
+    """
+    index = resources.get_compact_index()
+    cache = resources.get_embedding_cache()
+    queries = cache.get_or_compute(sorted({text for (text,) in texts}), resources.get_model().encode)
+    recalls = {"rerank": [], "no_rerank": [], "chroma_hnsw": []}
+    for query in queries:
+        truth = {record_id for record_id, _ in index.search(query, k, exact=True)}
+        if not truth:
+            continue
+        recalls["rerank"].append(len(truth & {rid for rid, _ in index.search(query, k)}) / len(truth))
+        recalls["no_rerank"].append(
+            len(truth & {rid for rid, _ in index.search(query, k, rerank=False)}) / len(truth)
+        )
+        hnsw = resources.get_collection().query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        recalls["chroma_hnsw"].append(len(truth & set(hnsw["ids"][0])) / len(truth))
+
+    result = summarize(time_calls(lambda text: query_collection.query_by_text(text, compact=True, hybrid=False), texts))
+    result.update({f"recall@{k}_{name}": sum(values) / len(values) for name, values in recalls.items() if values})
+    result.update(index.stats())
+    return result
+
+
+def query_worker(n_queries, seed, llm_backend, chat_queries, concurrency):
+    """Runs inside the working directory; prints one JSON line of results."""
+    sys.path.insert(0, ROOT)
+    rng = random.Random(seed)
+    results = {}
+
+    import metrics
+    import query_collection
+    import resources
+    metrics.enable()
+
+    texts = [(rng.choice(TEXT_QUERIES),) for _ in range(n_queries)]
+    results["query_by_text"] = summarize(time_calls(query_collection.query_by_text, texts))
+    if resources.has_compact_index():
+        results["query_by_text_compact"] = measure_compact(query_collection, resources, texts)
+    if resources.has_lexical_index():
+        # query_by_text above was hybrid; also time dense-only and exact-ID lookups
+        results["query_by_text_dense"] = summarize(
+            time_calls(lambda text: query_collection.query_by_text(text, hybrid=False), texts)
+        )
+        sample = resources.get_collection().get(where={"record_type": "transaction"}, include=[], limit=1000)
+        lookups = [(rng.choice(sample["ids"])[len("txn_"):],) for _ in range(n_queries)] if sample["ids"] else []
+        results["query_by_text_exact_id"] = summarize(time_calls(query_collection.query_by_text, lookups))
+
+    filters = [(rng.choice(METADATA_FILTERS),) for _ in range(n_queries)]
+    try:
+        results["query_by_metadata"] = summarize(time_calls(query_collection.query_by_metadata, filters))
+    except Exception as e:
+        results["query_by_metadata"] = {"error": str(e)}
+
+    # seeded offers are valid around the generator's fixed base date, not today
+    from data_use_case_1 import SEEDED_BASE_DATE
+    os.environ.setdefault("RECOMMENDATION_AS_OF", SEEDED_BASE_DATE.isoformat())
+    try:
+        from financial_assistant import TransactionAssistant
+        assistant = TransactionAssistant(llm_backend=llm_backend)
+    except ValueError as e:
+        results["get_transaction_recommendations"] = {"skipped": str(e)}
+        results["chat"] = {"skipped": str(e)}
+    else:
+        sample = resources.get_collection().get(
+            where={"record_type": "transaction"}, include=["metadatas"], limit=1000
+        )
+        user_ids = sorted({metadata["user_id"] for metadata in sample["metadatas"]})
+        # Bypass the result cache so every call does the full retrieval
+        assistant.recommendation_cache.maxsize = 0
+        calls = [(rng.choice(user_ids),) for _ in range(n_queries)] if user_ids else []
+        results["get_transaction_recommendations"] = summarize(
+            time_calls(assistant.get_transaction_recommendations, calls)
+        )
+
+        questions = [
+            f"What categories am I buying from? My user id is {rng.choice(user_ids)}. "
+            "Suggest me recommendations for my transaction history."
+            for _ in range(chat_queries)
+        ] if user_ids else []
+        # Like recommendations, chat is timed without the answer cache first
+        answer_cache_size = assistant.answer_cache.maxsize
+        assistant.answer_cache.maxsize = 0
+        results["chat"] = measure_chat(assistant, questions)
+        if questions:
+            results["chat_long_session"] = measure_long_session(assistant, questions)
+        if concurrency > 0 and questions:
+            results["achat_concurrent"] = measure_concurrent_chat(assistant, questions * 4, concurrency)
+        if questions:
+            assistant.answer_cache.maxsize = answer_cache_size
+            results["chat_answer_cache"] = measure_answer_cache(assistant, questions)
+
+    # where the time went, across every call above
+    results["stages"] = metrics.to_json()
+    print(json.dumps(results))
+
+
+def benchmark_size(size, args, workdir):
+    os.makedirs(workdir, exist_ok=True)
+    result = {"records": size}
+    # a directory of shards, or a single .jsonl file so embedding.py picks the JSONL reader
+    data_path = os.path.join(workdir, "data" if args.workers > 1 else "data.jsonl")
+
+    elapsed, _, _ = run_measured([
+        sys.executable, os.path.join(ROOT, "data_use_case_1.py"),
+        "--seed", str(args.seed),
+        "--transactions", str(size),
+        "--users", str(max(1, size // 20)),
+        "--offers", str(args.catalog_size),
+        "--assets", str(args.catalog_size),
+        "--strategies", str(args.catalog_size),
+        "--shards", str(args.workers),
+        "--workers", str(args.workers),
+        "--format", "jsonl",
+        "--output", data_path,
+    ], workdir, os.path.join(workdir, "generate.log"))
+    result["generate_seconds"] = elapsed
+
+    ingest_cmd = [
+        sys.executable, os.path.join(ROOT, "embedding.py"), data_path,
+        "--workers", str(args.ingest_workers),
+    ]
+    if not args.use_cache:
+        ingest_cmd.append("--no-cache")
+    if args.compact_index:
+        ingest_cmd += ["--compact-index", args.compact_index]
+    if args.lexical_index:
+        ingest_cmd.append("--lexical-index")
+    elapsed, peak_rss, _ = run_measured(ingest_cmd, workdir, os.path.join(workdir, "ingest.log"))
+    total = size + 3 * args.catalog_size
+    result["ingest"] = {
+        "seconds": elapsed,
+        "records_per_sec": total / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss,
+    }
+
+    elapsed, peak_rss, output = run_measured([
+        sys.executable, os.path.abspath(__file__), "--query-worker",
+        "--queries", str(args.queries), "--seed", str(args.seed),
+        "--llm-backend", args.llm_backend,
+        "--chat-queries", str(args.chat_queries),
+        "--concurrency", str(args.concurrency),
+    ], workdir, os.path.join(workdir, "query.log"))
+    result["queries"] = json.loads(output.strip().splitlines()[-1])
+    result["queries"]["peak_rss_mb"] = peak_rss
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion throughput and retrieval latency.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000],
+                        help="number of transactions per index")
+    parser.add_argument("--catalog-size", type=int, default=50,
+                        help="offers, assets and strategies generated (each)")
+    parser.add_argument("--queries", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--llm-backend", choices=["fake", "azure"], default="fake",
+                        help="LLM used for the chat measurements")
+    parser.add_argument("--chat-queries", type=int, default=20, help="timed chat calls")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="concurrent achat calls for the throughput test (0 to skip)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes used to generate data")
+    parser.add_argument("--ingest-workers", type=int, default=1, help="embedding.py --workers")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="let embedding.py use the embedding cache (off by default)")
+    parser.add_argument("--compact-index", choices=["int8", "float16"],
+                        help="also build a quantized compact index and report its latency and recall")
+    parser.add_argument("--lexical-index", action="store_true",
+                        help="also build the BM25 index, so query_by_text runs hybrid")
+    parser.add_argument("--workdir", help="where indexes are built (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated indexes")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--query-worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.query_worker:
+        query_worker(args.queries, args.seed, args.llm_backend, args.chat_queries, args.concurrency)
+        return
+
+    root_workdir = args.workdir or tempfile.mkdtemp(prefix="bench_")
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key != "query_worker"},
+        "results": [],
+    }
+    try:
+        for size in args.sizes:
+            print(f"=== {size} records ===")
+            result = benchmark_size(size, args, os.path.join(root_workdir, f"size_{size}"))
+            report["results"].append(result)
+            print(json.dumps(result, indent=2))
+            # Write after every size so a long run still leaves partial results
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root_workdir, ignore_errors=True)
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
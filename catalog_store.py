@@ -0,0 +1,364 @@
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import resources
+from partitions import partition_of
+
+DEFAULT_STORE_DIR = resources.CATALOG_STORE_DIR
+
+# Field -> column kind, in the order records are hydrated. "text" is a
+# fixed-width unicode column, "value" a scalar of any JSON type, and "list"
+# and "dict" are ragged columns of such values. Chroma metadata holds
+# lists as ", "-joined strings and dicts as JSON; both are decoded once,
+# when the record is written here, instead of on every request.
+SCHEMAS = {
+    "offer": (
+        ("name", "text"),
+        ("description", "text"),
+        ("type", "text"),
+        ("discount_value", "dict"),
+        ("applicable_categories", "list"),
+        ("minimum_transaction_amount", "value"),
+    ),
+    "investment_strategy": (
+        ("name", "text"),
+        ("risk_profile", "text"),
+        ("time_horizon", "text"),
+        ("target_annual_return", "value"),
+        ("allocation_blueprint", "dict"),
+        ("performance_metrics", "dict"),
+    ),
+    "financial_asset": (
+        ("name", "text"),
+        ("type", "text"),
+        ("issuer", "text"),
+        ("risk_rating", "value"),
+        ("expected_return", "value"),
+    ),
+}
+
+# Type codes of "value" cells; numbers and booleans live in a float64
+# column, strings in a unicode column
+NONE, INT, FLOAT, BOOL, STR, JSON = range(6)
+# versions kept on disk, so readers that just opened the previous one can finish
+KEEP_VERSIONS = 2
+# times table() re-reads CURRENT when the version it names was removed meanwhile
+OPEN_RETRIES = 5
+
+
+def _text(strings: Sequence[str]) -> np.ndarray:
+    width = max((len(s) for s in strings), default=1)
+    return np.array(list(strings), dtype=f"U{max(1, width)}")
+
+
+def _encode_values(values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    kinds = np.zeros(len(values), dtype=np.int8)
+    numbers = np.zeros(len(values), dtype=np.float64)
+    strings = [""] * len(values)
+    for i, value in enumerate(values):
+        if value is None:
+            kinds[i] = NONE
+        elif isinstance(value, bool):
+            kinds[i], numbers[i] = BOOL, value
+        elif isinstance(value, int):
+            kinds[i], numbers[i] = INT, value
+        elif isinstance(value, float):
+            kinds[i], numbers[i] = FLOAT, value
+        elif isinstance(value, str):
+            kinds[i], strings[i] = STR, value
+        else:
+            # nested structures are rare enough to keep as JSON
+            kinds[i], strings[i] = JSON, json.dumps(value)
+    return kinds, numbers, _text(strings)
+
+
+def from_metadata(record_type: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Decode a record's Chroma metadata into typed fields."""
+    record = {}
+    for field, kind in SCHEMAS[record_type]:
+        value = metadata.get(field)
+        if kind == "text":
+            record[field] = "" if value is None else str(value)
+        elif kind == "list":
+            record[field] = [item for item in value.split(", ") if item] if isinstance(value, str) else list(value or [])
+        elif kind == "dict":
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    value = {}
+            record[field] = value if isinstance(value, dict) else {}
+        else:
+            record[field] = value
+    return record
+
+
+class CatalogTable:
+    """
+    Immutable, memory-mapped columns of one record type. Rows are
+    addressed by index: rows() maps record IDs to rows, search() ranks rows
+    against a query vector, and records() hydrates rows into dicts.
+    """
+
+    def __init__(self, record_type: str, directory: Optional[str] = None):
+        self.record_type = record_type
+        self.columns: Dict[str, np.ndarray] = {}
+        if directory is None:
+            self.ids = _text([])
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+        else:
+            for name in os.listdir(directory):
+                if name.endswith(".npy"):
+                    self.columns[name[:-4]] = np.load(os.path.join(directory, name), mmap_mode="r")
+            self.ids = self.columns.pop("ids")
+            self.embeddings = self.columns.pop("embeddings")
+        self.row_of = {str(record_id): row for row, record_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows(self, record_ids: Iterable[str]) -> np.ndarray:
+        """Row indices of the given IDs, skipping any not in the table."""
+        return np.asarray([self.row_of[r] for r in record_ids if r in self.row_of], dtype=np.int64)
+
+    def search(self, query, k: int, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """The (at most) k rows most similar to 'query', best first."""
+        candidates = np.arange(len(self.ids)) if rows is None else np.asarray(rows, dtype=np.int64)
+        k = min(k, len(candidates))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        # embeddings are stored L2-normalised, so this ranks by cosine similarity
+        scores = self.embeddings[candidates] @ np.asarray(query, dtype=np.float32).ravel()
+        top = np.argpartition(-scores, k - 1)[:k]
+        return candidates[top[np.argsort(-scores[top])]]
+
+    def _value(self, field: str, i: int) -> Any:
+        kind = self.columns[f"{field}.kind"][i]
+        if kind == INT:
+            return int(self.columns[f"{field}.num"][i])
+        if kind == FLOAT:
+            return float(self.columns[f"{field}.num"][i])
+        if kind == BOOL:
+            return bool(self.columns[f"{field}.num"][i])
+        if kind == STR:
+            return str(self.columns[f"{field}.str"][i])
+        if kind == JSON:
+            return json.loads(str(self.columns[f"{field}.str"][i]))
+        return None
+
+    def record(self, row: int) -> Dict[str, Any]:
+        record = {}
+        for field, kind in SCHEMAS[self.record_type]:
+            if kind == "text":
+                record[field] = str(self.columns[field][row])
+            elif kind == "value":
+                record[field] = self._value(field, row)
+            else:
+                offsets = self.columns[f"{field}.offsets"]
+                cells = range(int(offsets[row]), int(offsets[row + 1]))
+                values = [self._value(field, i) for i in cells]
+                if kind == "list":
+                    record[field] = values
+                else:
+                    keys = self.columns[f"{field}.keys"]
+                    record[field] = {str(keys[i]): value for i, value in zip(cells, values)}
+        return record
+
+    def records(self, rows: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self.record(int(row)) for row in rows]
+
+
+class CatalogStore:
+    """
+    Offers, strategies and assets in typed, memory-mapped columns (one
+    .npy file per column), keyed by record ID, so recommendations are
+    ranked and hydrated without fetching or parsing Chroma metadata.
+
+    Each record type is written as a whole new version directory and
+    published by atomically replacing its CURRENT file; readers notice the
+    new version on their next table() call. Every write rewrites the
+    table, so bulk loads go through batch(), which writes each changed
+    table once at the end instead of once per chunk.
+    """
+
+    def __init__(self, directory: str = DEFAULT_STORE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.RLock()
+        # record type -> ((inode, mtime) of its CURRENT file, table)
+        self._tables: Dict[str, Tuple[Tuple[int, int], CatalogTable]] = {}
+        # record type -> (upserts, deleted IDs) buffered by batch(), or None outside one
+        self._pending: Optional[Dict[str, Tuple[Dict[str, Tuple[Dict[str, Any], Any]], set]]] = None
+
+    def table(self, record_type: str) -> CatalogTable:
+        current = os.path.join(self.directory, record_type, "CURRENT")
+        for attempt in range(OPEN_RETRIES):
+            try:
+                stat = os.stat(current)
+            except FileNotFoundError:
+                return CatalogTable(record_type)
+            # one stat per call; the inode alone could be reused by a later write
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+            cached = self._tables.get(record_type)
+            if cached is not None and cached[0] == stamp:
+                return cached[1]
+            with self._lock:
+                try:
+                    with open(current, "r", encoding="utf-8") as f:
+                        version = f.read().strip()
+                    table = CatalogTable(record_type, os.path.join(self.directory, record_type, version))
+                except FileNotFoundError:
+                    # another process published twice since the stat and removed
+                    # the version read here; CURRENT names a newer one by now
+                    if attempt == OPEN_RETRIES - 1:
+                        raise
+                    continue
+                self._tables[record_type] = (stamp, table)
+                return table
+
+    def _write(self, record_type: str, ids: List[str], records: List[Dict[str, Any]], embeddings) -> None:
+        """Publish a new version of a table; caller holds the lock."""
+        base = os.path.join(self.directory, record_type)
+        version = f"v{time.time_ns()}"
+        directory = os.path.join(base, version)
+        os.makedirs(directory)
+
+        if ids:
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float32)
+        columns = {"ids": _text(ids), "embeddings": embeddings}
+        for field, kind in SCHEMAS[record_type]:
+            values = [record[field] for record in records]
+            if kind == "text":
+                columns[field] = _text(values)
+                continue
+            if kind in ("list", "dict"):
+                lengths = [len(value) for value in values]
+                columns[f"{field}.offsets"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+                if kind == "dict":
+                    columns[f"{field}.keys"] = _text([str(key) for value in values for key in value])
+                    values = [item for value in values for item in value.values()]
+                else:
+                    values = [item for value in values for item in value]
+            kinds, numbers, strings = _encode_values(values)
+            columns[f"{field}.kind"], columns[f"{field}.num"], columns[f"{field}.str"] = kinds, numbers, strings
+        for name, array in columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+
+        tmp_path = os.path.join(base, "CURRENT.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(base, "CURRENT"))
+        for old in sorted(name for name in os.listdir(base) if name.startswith("v"))[:-KEEP_VERSIONS]:
+            shutil.rmtree(os.path.join(base, old), ignore_errors=True)
+
+    def _apply(self, record_type: str, upserts: Dict[str, Tuple[Dict[str, Any], Any]],
+               deleted: Iterable[str] = ()) -> None:
+        with self._lock:
+            current = self.table(record_type)
+            skip = set(deleted) | set(upserts)
+            rows = [(record_id, row) for record_id, row in current.row_of.items() if record_id not in skip]
+            ids = [record_id for record_id, _ in rows] + list(upserts)
+            records = current.records(row for _, row in rows) + [record for record, _ in upserts.values()]
+            embeddings = [current.embeddings[row] for _, row in rows] + [vector for _, vector in upserts.values()]
+            if ids or len(current):
+                self._write(record_type, ids, records, embeddings)
+
+    @contextmanager
+    def batch(self):
+        """
+        Buffer upserts and deletes made in the block and write each changed
+        table once when it exits, so a bulk load costs one rewrite per
+        table rather than one per chunk. Readers see the old tables until
+        then. Yields a set that holds the record types written once the
+        block has exited.
+        """
+        written = set()
+        with self._lock:
+            nested = self._pending is not None
+            if not nested:
+                self._pending = {}
+        if nested:
+            yield written
+            return
+        try:
+            yield written
+            with self._lock:
+                for record_type, (upserts, deleted) in self._pending.items():
+                    if upserts or any(record_id in self.table(record_type).row_of for record_id in deleted):
+                        self._apply(record_type, upserts, deleted)
+                        written.add(record_type)
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def upsert(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]], embeddings) -> int:
+        """Write the catalog records among a chunk; other record types are ignored."""
+        groups: Dict[str, Dict[str, Tuple[Dict[str, Any], Any]]] = {}
+        for record_id, metadata, vector in zip(ids, metadatas, embeddings):
+            record_type = metadata.get("record_type")
+            if record_type in SCHEMAS:
+                record = (from_metadata(record_type, metadata), np.asarray(vector, dtype=np.float32))
+                groups.setdefault(record_type, {})[record_id] = record
+        with self._lock:
+            for record_type, upserts in groups.items():
+                if self._pending is None:
+                    self._apply(record_type, upserts)
+                    continue
+                pending_upserts, pending_deleted = self._pending.setdefault(record_type, ({}, set()))
+                pending_upserts.update(upserts)
+                pending_deleted.difference_update(upserts)
+        return sum(len(upserts) for upserts in groups.values())
+
+    def delete(self, record_ids: Iterable[str]) -> None:
+        groups: Dict[str, List[str]] = {}
+        for record_id in record_ids:
+            record_type = partition_of(record_id)
+            if record_type in SCHEMAS:
+                groups.setdefault(record_type, []).append(record_id)
+        with self._lock:
+            for record_type, ids in groups.items():
+                if self._pending is not None:
+                    pending_upserts, pending_deleted = self._pending.setdefault(record_type, ({}, set()))
+                    for record_id in ids:
+                        pending_upserts.pop(record_id, None)
+                    pending_deleted.update(ids)
+                elif any(record_id in self.table(record_type).row_of for record_id in ids):
+                    self._apply(record_type, {}, ids)
+
+    def count(self) -> int:
+        return sum(len(self.table(record_type)) for record_type in SCHEMAS)
+
+    def rebuild(self, collection, page_size: int = 5000) -> int:
+        """Re-create every table from the catalog metadata and embeddings in a Chroma collection."""
+        total = 0
+        with self._lock:
+            for record_type in SCHEMAS:
+                ids, records, embeddings = [], [], []
+                offset = 0
+                while True:
+                    page = collection.get(
+                        where={"record_type": record_type},
+                        include=["metadatas", "embeddings"],
+                        limit=page_size,
+                        offset=offset
+                    )
+                    if not page["ids"]:
+                        break
+                    ids.extend(page["ids"])
+                    records.extend(from_metadata(record_type, metadata) for metadata in page["metadatas"])
+                    embeddings.extend(page["embeddings"])
+                    offset += len(page["ids"])
+                if ids or len(self.table(record_type)):
+                    self._write(record_type, ids, records, embeddings)
+                total += len(ids)
+        return total
@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import resources
+
+DEFAULT_INDEX_DIR = resources.COMPACT_INDEX_DIR
+DEFAULT_DIM = 384                 # all-MiniLM-L6-v2
+RERANK_FACTOR = 10                # shortlist size = k * RERANK_FACTOR
+SCAN_BLOCK_ROWS = 65536           # rows dequantized at a time during the first pass
+
+RECORD_TYPES = ("transaction", "offer", "financial_asset", "investment_strategy")
+DELETED = -1
+
+
+class CompactIndex:
+    """
+    Brute-force vector index over quantized, memory-mapped vectors.
+
+    The first pass scores every vector in a contiguous int8 (one scale per
+    vector) or float16 array, which is 4x or 2x smaller than float32. The
+    best 'k * rerank_factor' candidates are then re-ranked exactly against
+    a float32 copy that stays on disk, so only the shortlist's rows are
+    ever paged in. Distances are squared L2, like the Chroma collection.
+
+    Rows are append-only: upserting an existing ID overwrites its row and
+    deleting one marks it, so the arrays only grow. A SQLite table maps
+    record IDs to rows.
+    """
+
+    def __init__(self, directory: str = DEFAULT_INDEX_DIR, dtype: str = "int8", dim: int = DEFAULT_DIM):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, "rows.sqlite3"), timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS rows (record_id TEXT PRIMARY KEY, row INTEGER UNIQUE)")
+        self.db.commit()
+
+        # an existing index keeps the layout it was built with
+        meta = dict(self.db.execute("SELECT key, value FROM meta").fetchall())
+        self.dtype = meta.get("dtype", dtype)
+        self.dim = int(meta.get("dim", dim))
+        if self.dtype not in ("int8", "float16"):
+            raise ValueError(f"Unsupported compact index dtype: {self.dtype}")
+        if not meta:
+            self.db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                [("dtype", self.dtype), ("dim", str(self.dim)), ("size", "0")])
+            self.db.commit()
+        self.capacity = 0
+        self._map(max(self._size(), 1))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _size(self) -> int:
+        return int(self.db.execute("SELECT value FROM meta WHERE key = 'size'").fetchone()[0])
+
+    def _open(self, name: str, dtype, shape: Tuple[int, ...]) -> np.memmap:
+        path = self._path(name)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if not os.path.exists(path) or os.path.getsize(path) < nbytes:
+            with open(path, "ab") as f:
+                f.truncate(nbytes)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _map(self, capacity: int) -> None:
+        """(Re)map every array with room for at least 'capacity' rows."""
+        if capacity <= self.capacity:
+            return
+        # grow geometrically so a long ingest remaps only a few times
+        capacity = max(capacity, 2 * self.capacity, 1024)
+        types_path = self._path("types.i8")
+        if os.path.exists(types_path):
+            # one byte per row, so this is the capacity the files already have
+            capacity = max(capacity, os.path.getsize(types_path))
+        self.quantized = self._open(f"vectors.{self.dtype}", self.dtype, (capacity, self.dim))
+        self.scales = self._open("scales.f32", np.float32, (capacity,))
+        self.full = self._open("full.f32", np.float32, (capacity, self.dim))
+        self.norms = self._open("norms.f32", np.float32, (capacity,))
+        self.types = self._open("types.i8", np.int8, (capacity,))
+        self.capacity = capacity
+
+    def _quantize(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _rows(self, record_ids: Sequence[str]) -> Dict[str, int]:
+        rows = {}
+        record_ids = list(record_ids)
+        for i in range(0, len(record_ids), 500):
+            batch = record_ids[i:i + 500]
+            rows.update(self.db.execute(
+                f"SELECT record_id, row FROM rows WHERE record_id IN ({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall())
+        return rows
+
+    def upsert(self, record_ids: Sequence[str], vectors, record_types: Sequence[str]) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(record_ids):
+            return
+        with self._lock:
+            existing = self._rows(record_ids)
+            size = self._size()
+            rows = []
+            new_rows = []
+            for record_id in record_ids:
+                row = existing.get(record_id)
+                if row is None:
+                    row = size
+                    size += 1
+                    existing[record_id] = row
+                    new_rows.append((record_id, row))
+                rows.append(row)
+            self._map(size)
+
+            rows = np.asarray(rows)
+            self.quantized[rows], self.scales[rows] = self._quantize(vectors)
+            self.full[rows] = vectors
+            self.norms[rows] = np.einsum("ij,ij->i", vectors, vectors)
+            self.types[rows] = [RECORD_TYPES.index(t) for t in record_types]
+            for array in (self.quantized, self.scales, self.full, self.norms, self.types):
+                array.flush()
+
+            self.db.executemany("INSERT INTO rows (record_id, row) VALUES (?, ?)", new_rows)
+            self.db.execute("UPDATE meta SET value = ? WHERE key = 'size'", (str(size),))
+            self.db.commit()
+
+    def delete(self, record_ids: Iterable[str]) -> None:
+        with self._lock:
+            rows = list(self._rows(list(record_ids)).values())
+            if rows:
+                self.types[rows] = DELETED
+                self.types.flush()
+
+    def search(self, query, k: int = 5, record_type: Optional[str] = None,
+               rerank_factor: int = RERANK_FACTOR, rerank: bool = True,
+               exact: bool = False) -> List[Tuple[str, float]]:
+        """
+        Return up to 'k' (record id, squared L2 distance) pairs, nearest
+        first. With rerank=False the quantized scores are returned as is,
+        and exact=True scans the float32 copy instead; both are only useful
+        for measuring accuracy.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        # the lock only covers reading the size and remapping; the scan uses
+        # these references, which stay valid if a concurrent upsert remaps
+        with self._lock:
+            size = self._size()
+            self._map(size)  # another process may have grown the index
+            quantized, scales, full, norms, types = self.quantized, self.scales, self.full, self.norms, self.types
+
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, SCAN_BLOCK_ROWS):
+            end = min(size, start + SCAN_BLOCK_ROWS)
+            if exact:
+                scores[start:end] = full[start:end] @ query
+                continue
+            block = quantized[start:end].astype(np.float32) @ query
+            if self.dtype == "int8":
+                block *= scales[start:end]
+            scores[start:end] = block
+
+        types = np.asarray(types[:size])
+        if record_type is None:
+            scores[types == DELETED] = -np.inf
+        else:
+            scores[types != RECORD_TYPES.index(record_type)] = -np.inf
+
+        valid = int(np.isfinite(scores).sum())
+        rerank = rerank and not exact
+        shortlist_size = min(valid, k * max(1, rerank_factor) if rerank else k)
+        if shortlist_size == 0:
+            return []
+        shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size]
+        if rerank:
+            shortlist = np.sort(shortlist)  # read the float32 rows in file order
+            scores = full[shortlist] @ query
+        else:
+            scores = scores[shortlist]
+        order = np.argsort(-scores)[:k]
+        rows = shortlist[order]
+        distances = norms[rows] + float(query @ query) - 2.0 * scores[order]
+
+        with self._lock:
+            ids = dict(self.db.execute(
+                f"SELECT row, record_id FROM rows WHERE row IN ({', '.join('?' * len(rows))})",
+                [int(row) for row in rows]
+            ).fetchall())
+        return [(ids[int(row)], float(distance)) for row, distance in zip(rows, distances)]
+
+    def count(self) -> int:
+        with self._lock:
+            size = self._size()
+            return int((np.asarray(self.types[:size]) != DELETED).sum())
+
+    def stats(self) -> dict:
+        """Bytes scanned per query (first pass) versus the full-precision copy."""
+        size = self._size()
+        itemsize = np.dtype(self.dtype).itemsize
+        first_pass = size * (self.dim * itemsize + (4 if self.dtype == "int8" else 0))
+        return {
+            "dtype": self.dtype,
+            "vectors": size,
+            "first_pass_bytes": first_pass,
+            "full_precision_bytes": size * self.dim * 4,
+        }
@@ -0,0 +1,137 @@
+import os
+import re
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+from session_memory import count_tokens
+
+# Tokens of retrieved records that go into the QA prompt's {context} slot
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "400"))
+
+# record_to_text joins "Name: value" fields with this
+FIELD_SEPARATOR = " • "
+# Fields that rarely help answer a question. Each is kept only when the
+# question mentions one of its keywords, or the field's value itself
+OPTIONAL_FIELDS = {
+    "Transaction ID": ("transaction id",),
+    "Offer ID": ("offer id",),
+    "Asset ID": ("asset id",),
+    "Strategy ID": ("strategy id",),
+    "Items": ("item", "product", "quantity"),
+}
+UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def parse_fields(document: str) -> List[Tuple[str, str]]:
+    """Split a record_to_text document into (name, value) pairs."""
+    fields = []
+    for part in document.split(FIELD_SEPARATOR):
+        name, separator, value = part.partition(": ")
+        # anything that is not "Name: value" (e.g. a JSON fallback) stays whole
+        fields.append((name, value) if separator else ("", part))
+    return fields
+
+
+class ContextCompressor:
+    """
+    Turns retrieved documents (best first) into the text for the prompt's
+    {context} slot, within 'token_budget' tokens:
+
+    - fields the question does not ask about are dropped (OPTIONAL_FIELDS,
+      empty fields), and so are other users' transactions when the
+      question names a user, whose ID is then stated once instead of on
+      every record;
+    - records that end up identical are merged into one line with a count;
+    - lines are packed in rank order, skipping any that no longer fit.
+
+    Every call reports the tokens it saved against the raw documents, and
+    running totals are kept for stats().
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @staticmethod
+    def _relevant(name: str, value: str, question: str) -> bool:
+        if value and value.lower() in question:
+            return True
+        return any(keyword in question for keyword in OPTIONAL_FIELDS[name])
+
+    def _compress_record(self, fields: List[Tuple[str, str]], question: str,
+                         user_ids: List[str]) -> Tuple[str, bool]:
+        """Returns the record's text ("" to drop it) and whether its user ID was left out."""
+        values = dict(fields)
+        user_id = values.get("User ID", "").lower()
+        own_record = False
+        if user_id and user_ids:
+            own_record = user_id in user_ids
+            transaction_id = values.get("Transaction ID", "").lower()
+            if not own_record and not (transaction_id and transaction_id in question):
+                return "", False
+
+        kept = []
+        for name, value in fields:
+            if not value.strip():
+                continue
+            if name == "User ID" and own_record and len(user_ids) == 1:
+                continue
+            if name in OPTIONAL_FIELDS and not self._relevant(name, value, question):
+                continue
+            kept.append(f"{name}: {value}" if name else value)
+        return FIELD_SEPARATOR.join(kept), own_record and len(user_ids) == 1
+
+    def compress(self, question: str, documents: Sequence[str]) -> Tuple[str, Dict[str, int]]:
+        """Return the packed context and this request's report."""
+        question = question.lower()
+        user_ids = list(dict.fromkeys(UUID_RE.findall(question)))
+
+        # compressed text -> number of records that compressed to it, in rank order
+        lines: Dict[str, int] = {}
+        user_stated = False
+        for document in documents:
+            text, own_record = self._compress_record(parse_fields(document), question, user_ids)
+            if text:
+                lines[text] = lines.get(text, 0) + 1
+                user_stated = user_stated or own_record
+
+        header = f"Transactions below belong to user {user_ids[0]}." if user_stated else ""
+        packed = [header] if header else []
+        used = count_tokens(header)
+        for text, count in lines.items():
+            line = text if count == 1 else f"{text} (x{count})"
+            tokens = count_tokens(line) + 1  # newline
+            if used + tokens > self.token_budget:
+                continue
+            packed.append(line)
+            used += tokens
+        context = "\n".join(packed)
+
+        # the chain would have joined the raw documents with blank lines
+        before = count_tokens("\n\n".join(documents))
+        after = count_tokens(context)
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += before
+            self.tokens_after += after
+        report = {
+            "documents": len(documents),
+            "packed": len(packed) - (1 if header else 0),
+            "tokens_before": before,
+            "tokens_after": after,
+            "tokens_saved": before - after,
+        }
+        return context, report
+
+    def stats(self) -> dict:
+        saved = self.tokens_before - self.tokens_after
+        return {
+            "requests": self.requests,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": saved,
+            "tokens_saved_per_request": saved / self.requests if self.requests else 0.0,
+        }
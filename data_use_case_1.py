@@ -1,48 +1,124 @@
+import argparse
+import functools
+import itertools
+import multiprocessing
+import os
 import uuid
 import random
 import json
 from datetime import datetime, timedelta
 
-def now(): return datetime.now().isoformat()
-def future(days): return (datetime.now() + timedelta(days=days)).isoformat()
+# Reference "now" for seeded runs, so the same seed always yields the same file
+SEEDED_BASE_DATE = datetime(2025, 6, 1)
 
-def random_tags():
-    return random.sample(["business", "urgent", "personal", "gift", "recurring", "travel"], k=random.randint(0, 3))
+BASE_DATE = None   # None means "use the wall clock"
 
-def location_data():
+def now(): return (BASE_DATE or datetime.now()).isoformat()
+def future(days): return ((BASE_DATE or datetime.now()) + timedelta(days=days)).isoformat()
+
+CATEGORIES = ["dining", "electronics", "travel", "groceries"]
+MERCHANTS = {
+    "dining": ["Swiggy", "Zomato", "Amazon"],
+    "electronics": ["Amazon", "Flipkart", "Croma"],
+    "travel": ["Uber", "IRCTC", "MakeMyTrip"],
+    "groceries": ["BigBasket", "Grofers", "Flipkart"],
+}
+PAYMENT_METHODS = ["credit card", "debit card", "UPI", "net banking"]
+CITIES = ["Delhi", "Mumbai", "Bangalore", "Chennai", "Hyderabad"]
+
+def new_id(rng=random):
+    """UUID4 drawn from 'rng', so seeded runs produce stable IDs."""
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def random_tags(rng=random):
+    return rng.sample(["business", "urgent", "personal", "gift", "recurring", "travel"], k=rng.randint(0, 3))
+
+def location_data(rng=random, city=None):
     return {
-        "geocoordinates": [round(random.uniform(-90, 90), 6), round(random.uniform(-180, 180), 6)],
-        "city": random.choice(["Delhi", "Mumbai", "Bangalore", "Chennai", "Hyderabad"]),
+        "geocoordinates": [round(rng.uniform(-90, 90), 6), round(rng.uniform(-180, 180), 6)],
+        "city": city or rng.choice(CITIES),
         "country": "India"
     }
 
-def generate_transaction():
+def generate_user(rng=random):
+    """
+    A synthetic customer: a skewed preference over categories, a home city,
+    a spending scale and a few recurring payments.
+    """
+    weights = [rng.random() ** 3 for _ in CATEGORIES]
+    recurring = []
+    for _ in range(rng.randint(0, 3)):
+        category = rng.choice(CATEGORIES)
+        recurring.append({
+            "category": category,
+            "merchant": rng.choice(MERCHANTS[category]),
+            "amount": round(rng.uniform(100, 3000), 2),
+            "frequency": rng.choice(["monthly", "weekly", "yearly"]),
+        })
     return {
-        "transaction_id": str(uuid.uuid4()),
-        "user_id": str(uuid.uuid4()),
-        "timestamp": now(),
-        "amount": round(random.uniform(100, 10000), 2),
+        "user_id": new_id(rng),
+        "category_weights": [w / sum(weights) for w in weights],
+        "city": rng.choice(CITIES),
+        "spend_scale": rng.lognormvariate(0, 0.6),
+        "payment_method": rng.choice(PAYMENT_METHODS),
+        "recurring": recurring,
+    }
+
+def generate_transaction(rng=random, user=None, timestamp=None):
+    """
+    Without 'user', this produces the original one-off transaction with a
+    fresh user_id. With a user from generate_user(), amounts, categories,
+    merchants and recurring payments follow that user's habits.
+    """
+    timestamp = timestamp or now()
+    if user is None:
+        user_id = new_id(rng)
+        category = rng.choice(CATEGORIES)
+        merchant = rng.choice(["Amazon", "Flipkart", "Swiggy", "Uber", "IRCTC"])
+        amount = round(rng.uniform(100, 10000), 2)
+        payment_method = rng.choice(PAYMENT_METHODS)
+        city = None
+        recurrence = {
+            "is_recurring": rng.choice([True, False]),
+            "frequency": rng.choice(["monthly", "weekly", "yearly", ""]) if rng.choice([True, False]) else ""
+        }
+    else:
+        user_id = user["user_id"]
+        city = user["city"]
+        payment_method = user["payment_method"] if rng.random() < 0.8 else rng.choice(PAYMENT_METHODS)
+        if user["recurring"] and rng.random() < 0.25:
+            payment = rng.choice(user["recurring"])
+            category, merchant, amount = payment["category"], payment["merchant"], payment["amount"]
+            recurrence = {"is_recurring": True, "frequency": payment["frequency"]}
+        else:
+            category = rng.choices(CATEGORIES, weights=user["category_weights"])[0]
+            merchant = rng.choice(MERCHANTS[category])
+            amount = round(min(100000.0, rng.uniform(100, 5000) * user["spend_scale"]), 2)
+            recurrence = {"is_recurring": False, "frequency": ""}
+
+    return {
+        "transaction_id": new_id(rng),
+        "user_id": user_id,
+        "timestamp": timestamp,
+        "amount": amount,
         "currency": "INR",
-        "category": random.choice(["dining", "electronics", "travel", "groceries"]),
-        "merchant_name": random.choice(["Amazon", "Flipkart", "Swiggy", "Uber", "IRCTC"]),
-        "payment_method": random.choice(["credit card", "debit card", "UPI", "net banking"]),
-        "location": location_data(),
-        "tags": random_tags(),
-        "recurrence": {
-            "is_recurring": random.choice([True, False]),
-            "frequency": random.choice(["monthly", "weekly", "yearly", ""]) if random.choice([True, False]) else ""
-        },
+        "category": category,
+        "merchant_name": merchant,
+        "payment_method": payment_method,
+        "location": location_data(rng, city),
+        "tags": random_tags(rng),
+        "recurrence": recurrence,
         "metadata": {
-            "invoice_details": f"INV-{random.randint(1000,9999)}",
+            "invoice_details": f"INV-{rng.randint(1000,9999)}",
             "itemized_breakdown": [
                 {"product": "Item A", "quantity": 1, "price": 499.0},
                 {"product": "Item B", "quantity": 2, "price": 250.0}
             ],
-            "loyalty_points_earned": random.randint(0, 100)
+            "loyalty_points_earned": rng.randint(0, 100)
         },
         "keywords": ["transaction", "finance", "payment"],
-        "created_at": now(),
-        "updated_at": now(),
+        "created_at": timestamp,
+        "updated_at": timestamp,
         "expiry_date": "",
         "compatible_user_profiles": ["frequent_shopper", "tech_savvy"],
         "prerequisites": []
@@ -79,15 +155,17 @@ OFFER_TEMPLATES = [
     }
 ]
 
-def generate_offer():
-    template = random.choice(OFFER_TEMPLATES)
-    min_amount = random.randint(*template["min_amount_range"])
-    discount = random.randint(*template["discount_range"])
-    category = random.choice(template["categories"])
-    merchant = random.choice(template["merchants"])
+def generate_offer(rng=random):
+    template = rng.choice(OFFER_TEMPLATES)
+    min_amount = rng.randint(*template["min_amount_range"])
+    discount = rng.randint(*template["discount_range"])
+    category = rng.choice(template["categories"])
+    merchant = rng.choice(template["merchants"])
+    # Validity windows start up to 45 days back, so some offers have expired
+    start_offset = -rng.randint(0, 45)
     
     return {
-        "offer_id": str(uuid.uuid4()),
+        "offer_id": new_id(rng),
         "name": template["name"],
         "description": template["description"].format(
             discount=discount,
@@ -103,8 +181,8 @@ def generate_offer():
             "value": discount
         },
         "validity_period": {
-            "start_date": now(),
-            "end_date": future(30)
+            "start_date": future(start_offset),
+            "end_date": future(start_offset + 30)
         },
         "partner_merchants": [merchant],
         "targeting_rules": {
@@ -119,7 +197,7 @@ def generate_offer():
         "keywords": ["offer", "cashback", "discount"],
         "created_at": now(),
         "updated_at": now(),
-        "expiry_date": future(30),
+        "expiry_date": future(start_offset + 30),
         "compatible_user_profiles": ["young_professionals"],
         "prerequisites": []
     }
@@ -155,14 +233,14 @@ ASSET_TEMPLATES = [
     }
 ]
 
-def generate_financial_asset():
-    template = random.choice(ASSET_TEMPLATES)
-    risk_rating = random.randint(*template["risk_rating_range"])
-    expected_return = round(random.uniform(*template["return_range"]), 2)
-    min_investment = random.randint(*template["min_investment_range"])
+def generate_financial_asset(rng=random):
+    template = rng.choice(ASSET_TEMPLATES)
+    risk_rating = rng.randint(*template["risk_rating_range"])
+    expected_return = round(rng.uniform(*template["return_range"]), 2)
+    min_investment = rng.randint(*template["min_investment_range"])
     
     return {
-        "asset_id": str(uuid.uuid4()),
+        "asset_id": new_id(rng),
         "type": template["type"],
         "name": template["name"],
         "issuer": template["issuer"],
@@ -231,12 +309,12 @@ STRATEGY_TEMPLATES = [
     }
 ]
 
-def generate_investment_strategy():
-    template = random.choice(STRATEGY_TEMPLATES)
-    target_return = round(random.uniform(*template["target_return_range"]), 1)
+def generate_investment_strategy(rng=random):
+    template = rng.choice(STRATEGY_TEMPLATES)
+    target_return = round(rng.uniform(*template["target_return_range"]), 1)
     
     return {
-        "strategy_id": str(uuid.uuid4()),
+        "strategy_id": new_id(rng),
         "name": template["name"],
         "risk_profile": template["risk_profile"],
         "time_horizon": template["time_horizon"],
@@ -244,7 +322,7 @@ def generate_investment_strategy():
         "allocation_blueprint": template["allocation"],
         "performance_metrics": {
             "backtested_results": f"{round(target_return - 0.2, 1)}% CAGR over 10 years",
-            "volatility_score": round(random.uniform(1.5, 2.5), 1),
+            "volatility_score": round(rng.uniform(1.5, 2.5), 1),
             "tax_efficiency_rating": "high"
         },
         "user_requirements": {
@@ -259,15 +337,133 @@ def generate_investment_strategy():
         "prerequisites": ["KYC", "Demat account"]
     }
 
-# Generate mock data with more variety
-mock_data = {
-    "transactions": [generate_transaction() for _ in range(5)],
-    "offers": [generate_offer() for _ in range(3)],
-    "financial_assets": [generate_financial_asset() for _ in range(3)],
-    "investment_strategies": [generate_investment_strategy() for _ in range(3)]
-}
+# Scalable generation: a seeded user population, with transactions split
+# into shards that are generated in parallel and streamed to disk.
+# Every random stream is derived from (seed, name), so the output does not
+# depend on the number of worker processes.
+def derived_rng(seed, name):
+    return random.Random(f"{seed}:{name}")
+
+@functools.lru_cache(maxsize=100_000)
+def user_at(seed, index):
+    return generate_user(derived_rng(seed, f"user:{index}"))
+
+@functools.lru_cache(maxsize=4)
+def activity_weights(n_users):
+    """Zipf-like cumulative weights: a few users are very active, most are not."""
+    return list(itertools.accumulate(1.0 / (i + 1) ** 1.1 for i in range(n_users)))
+
+def iter_transactions(seed, shard, count, n_users, days):
+    rng = derived_rng(seed, f"transactions:{shard}")
+    cum_weights = activity_weights(n_users)
+    indices = range(n_users)
+    window = days * 86400
+    base = BASE_DATE or datetime.now()
+    for _ in range(count):
+        user = user_at(seed, rng.choices(indices, cum_weights=cum_weights)[0])
+        timestamp = (base - timedelta(seconds=rng.uniform(0, window))).isoformat()
+        yield generate_transaction(rng, user, timestamp)
+
+def iter_catalog(seed, counts):
+    """Yield (section, record) for offers, assets and strategies."""
+    generators = {
+        "offers": generate_offer,
+        "financial_assets": generate_financial_asset,
+        "investment_strategies": generate_investment_strategy,
+    }
+    for section, generator in generators.items():
+        rng = derived_rng(seed, section)
+        for _ in range(counts[section]):
+            yield section, generator(rng)
+
+def write_jsonl_shard(path, seed, shard, count, n_users, days, base_date, catalog_counts=None):
+    """Write one shard as JSONL; the catalog (if given) goes first."""
+    global BASE_DATE
+    BASE_DATE = base_date
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        if catalog_counts:
+            for _, record in iter_catalog(seed, catalog_counts):
+                f.write(json.dumps(record) + "\n")
+                written += 1
+        for record in iter_transactions(seed, shard, count, n_users, days):
+            f.write(json.dumps(record) + "\n")
+            written += 1
+    return written
+
+def write_json(path, seed, count, n_users, days, catalog_counts):
+    """Write the sectioned JSON layout that embedding.py reads, one record at a time."""
+    sections = {"transactions": iter_transactions(seed, 0, count, n_users, days)}
+    for section, record in iter_catalog(seed, catalog_counts):
+        sections.setdefault(section, []).append(record)
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for s_index, (section, records) in enumerate(sections.items()):
+            f.write(("," if s_index else "") + f"\n  {json.dumps(section)}: [")
+            for r_index, record in enumerate(records):
+                f.write(("," if r_index else "") + "\n    " + json.dumps(record))
+                written += 1
+            f.write("\n  ]")
+        f.write("\n}\n")
+    return written
+
+def main():
+    global BASE_DATE
+    parser = argparse.ArgumentParser(description="Generate synthetic financial data.")
+    parser.add_argument("--output", default="mock_financial_data.json",
+                        help="output file, or a directory when --shards > 1")
+    parser.add_argument("--format", choices=["json", "jsonl"],
+                        help="default: jsonl if the output ends in .jsonl or is sharded, else json")
+    parser.add_argument("--transactions", type=int, default=5)
+    parser.add_argument("--users", type=int, help="size of the user population (default: transactions / 20)")
+    parser.add_argument("--offers", type=int, default=3)
+    parser.add_argument("--assets", type=int, default=3)
+    parser.add_argument("--strategies", type=int, default=3)
+    parser.add_argument("--days", type=int, default=180, help="length of the transaction history window")
+    parser.add_argument("--seed", type=int, help="makes the output reproducible")
+    parser.add_argument("--base-date", help="ISO date treated as 'now' (default: 2025-06-01 when seeded)")
+    parser.add_argument("--shards", type=int, default=1, help="number of JSONL files to split transactions into")
+    parser.add_argument("--workers", type=int, default=1, help="processes generating shards in parallel")
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.shards > 1 or args.output.endswith(".jsonl") else "json")
+    if fmt == "json" and args.shards > 1:
+        parser.error("--shards requires --format jsonl")
+
+    seed = args.seed if args.seed is not None else random.getrandbits(64)
+    if args.base_date:
+        BASE_DATE = datetime.fromisoformat(args.base_date)
+    elif args.seed is not None:
+        BASE_DATE = SEEDED_BASE_DATE
+    n_users = args.users or max(1, args.transactions // 20)
+    catalog_counts = {
+        "offers": args.offers,
+        "financial_assets": args.assets,
+        "investment_strategies": args.strategies,
+    }
+
+    if fmt == "json":
+        written = write_json(args.output, seed, args.transactions, n_users, args.days, catalog_counts)
+    else:
+        if args.shards > 1:
+            os.makedirs(args.output, exist_ok=True)
+            paths = [os.path.join(args.output, f"part-{shard:05d}.jsonl") for shard in range(args.shards)]
+        else:
+            paths = [args.output]
+        per_shard, extra = divmod(args.transactions, args.shards)
+        tasks = [
+            (path, seed, shard, per_shard + (shard < extra), n_users, args.days, BASE_DATE,
+             catalog_counts if shard == 0 else None)
+            for shard, path in enumerate(paths)
+        ]
+        if args.workers > 1 and args.shards > 1:
+            with multiprocessing.Pool(min(args.workers, args.shards)) as pool:
+                written = sum(pool.starmap(write_jsonl_shard, tasks))
+        else:
+            written = sum(write_jsonl_shard(*task) for task in tasks)
 
-with open("mock_financial_data.json", "w") as f:
-    json.dump(mock_data, f, indent=2)
+    print(f"Mock data generated successfully! {written} records, {n_users} users, seed {seed} -> {args.output}")
 
-print("Mock data generated successfully!")
+if __name__ == "__main__":
+    main()
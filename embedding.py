@@ -1,41 +1,68 @@
+import argparse
+import hashlib
 import json
+import multiprocessing
 import os
-from sentence_transformers import SentenceTransformer
-from chromadb import Client
-from chromadb.config import Settings
-import chromadb.errors
+import time
+from collections import deque
+import metrics
+import resources
 
 # 1) CONFIGURATION: adjust paths or parameters here if needed
 JSON_PATH = "mock_financial_data.json"       # Path to your uploaded JSON file
-COLLECTION_NAME = "financial_data"           # ChromaDB collection name
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"    # Sentence-Transformers model
+COLLECTION_NAME = resources.COLLECTION_NAME            # ChromaDB collection name
+EMBEDDING_MODEL_NAME = resources.EMBEDDING_MODEL_NAME  # Sentence-Transformers model
+ENCODE_BATCH_SIZE = 64                       # Texts per forward pass of the model
+UPLOAD_CHUNK_SIZE = 1000                     # Records per collection.upsert() call
 
-# 2) Load JSON data
-with open(JSON_PATH, "r", encoding="utf-8") as f:
-    data = json.load(f)
+# Top-level JSON section -> (record type, ID prefix, ID field)
+SECTIONS = {
+    "transactions": ("transaction", "txn_", "transaction_id"),
+    "offers": ("offer", "off_", "offer_id"),
+    "financial_assets": ("financial_asset", "asset_", "asset_id"),
+    "investment_strategies": ("investment_strategy", "strat_", "strategy_id"),
+}
 
-# 3) Initialize embedding model
-model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+# 2) Embedding model and ChromaDB collection. These are created from the
+# __main__ block rather than at import time, so that worker processes
+# (which re-import this module) only load what they need.
+model = None
+chroma_client = None
+collection = None
+cache = None   # EmbeddingCache shared with query_collection.py and the assistant
+user_index = None   # UserIndex mirroring transaction metadata for exact user_id lookups
+profiles = None     # ProfileStore with per-user spending profiles
+dirty_users = set() # users whose profiles must be recomputed after changes/deletes
+versions = None     # IndexVersions, bumped so readers' result caches go stale
+eligibility = None  # OfferEligibility with each offer's structured constraints
+catalog = None      # CatalogStore with offers, strategies and assets in typed columns
+compact_index = None  # optional quantized CompactIndex (--compact-index)
+lexical_index = None  # optional BM25Index over the embedded text (--lexical-index)
+CATALOG_RECORD_TYPES = ("offer", "investment_strategy")
 
-# 4) Initialize ChromaDB client & create (or get) a collection
-chroma_client = Client(Settings(
-    persist_directory="./chroma_db",
-    is_persistent=True  # Explicitly enable persistence
-))
+def load_model(threads: int = 0) -> None:
+    """Load the embedding model, optionally capping torch's intra-op threads."""
+    global model
+    if threads > 0:
+        import torch
+        torch.set_num_threads(threads)
+    model = resources.get_model()
 
-print(f"Using persistence directory: {os.path.abspath('./chroma_db')}")
+# 3) Initialize ChromaDB client & create (or get) the collection. Records are
+# routed to one Chroma collection per record type (see partitions.py).
+def open_collection() -> None:
+    global chroma_client, collection
+    chroma_client = resources.get_chroma_client()
 
-try:
-    collection = chroma_client.get_collection(name=COLLECTION_NAME)
-    print(f"Found existing collection: {COLLECTION_NAME}")
-except chromadb.errors.NotFoundError:
-    collection = chroma_client.create_collection(name=COLLECTION_NAME)
-    print(f"Created new collection: {COLLECTION_NAME}")
+    print(f"Using persistence directory: {os.path.abspath(resources.PERSIST_DIRECTORY)}")
 
-# Verify collection exists
-print(f"Collection count: {collection.count()}")
+    collection = resources.get_collection(create=True)
+    print(f"Using collection: {COLLECTION_NAME} (partitions: {', '.join(collection.partitions)})")
 
-# 5) Helper: build a text representation for a record
+    # Verify collection exists
+    print(f"Collection count: {collection.count()}")
+
+# 4) Helper: build a text representation for a record
 def record_to_text(record: dict, record_type: str) -> str:
     """
     Given a dictionary 'record' and its type (e.g., "transaction"),
@@ -94,96 +121,495 @@ def record_to_text(record: dict, record_type: str) -> str:
         # Fallback: full JSON dump
         return json.dumps(record)
 
-# 6) Iterate over each top‐level section and embed+upload
-# We will use a single Chroma collection, but prefix IDs with their type
-all_ids = []
-all_texts = []
-all_embeddings = []
-all_metadatas = []
-
-# 6.1 Transactions
-for tx in data.get("transactions", []):
-    rec_id = "txn_" + tx["transaction_id"]
-    text = record_to_text(tx, "transaction")
-    embedding = model.encode(text).tolist()
-
-    metadata = {
-        "record_type": "transaction",
-        "user_id": tx.get("user_id", ""),
-        "category": tx.get("category", ""),
-        "currency": tx.get("currency", ""),
-    }
-
-    all_ids.append(rec_id)
-    all_texts.append(text)
-    all_embeddings.append(embedding)
-    all_metadatas.append(metadata)
-
-# 6.2 Offers
-for off in data.get("offers", []):
-    rec_id = "off_" + off["offer_id"]
-    text = record_to_text(off, "offer")
-    embedding = model.encode(text).tolist()
-
-    metadata = {
-        "record_type": "offer",
-        "name": off.get("name", ""),
-        "description": off.get("description", ""),
-        "type": off.get("type", ""),
-        "applicable_categories": ", ".join(off.get("applicable_categories", [])),
-        "minimum_transaction_amount": off.get("minimum_transaction_amount", 0),
-        "discount_value": json.dumps(off.get("discount_value", {}))
-    }
-
-    all_ids.append(rec_id)
-    all_texts.append(text)
-    all_embeddings.append(embedding)
-    all_metadatas.append(metadata)
-
-# 6.3 Financial Assets
-for asset in data.get("financial_assets", []):
-    rec_id = "asset_" + asset["asset_id"]
-    text = record_to_text(asset, "financial_asset")
-    embedding = model.encode(text).tolist()
-
-    metadata = {
-        "record_type": "financial_asset",
-        "type": asset.get("type", ""),
-        "risk_rating": asset.get("risk_rating", ""),
-    }
-
-    all_ids.append(rec_id)
-    all_texts.append(text)
-    all_embeddings.append(embedding)
-    all_metadatas.append(metadata)
-
-# 6.4 Investment Strategies
-for strat in data.get("investment_strategies", []):
-    rec_id = "strat_" + strat["strategy_id"]
-    text = record_to_text(strat, "investment_strategy")
-    embedding = model.encode(text).tolist()
-
-    metadata = {
-        "record_type": "investment_strategy",
-        "name": strat.get("name", ""),
-        "risk_profile": strat.get("risk_profile", ""),
-        "time_horizon": strat.get("time_horizon", ""),
-        "target_annual_return": strat.get("target_annual_return", 0),
-        "allocation_blueprint": json.dumps(strat.get("allocation_blueprint", {})),
-        "performance_metrics": json.dumps(strat.get("performance_metrics", {}))
-    }
-
-    all_ids.append(rec_id)
-    all_texts.append(text)
-    all_embeddings.append(embedding)
-    all_metadatas.append(metadata)
-
-# 7) Add all documents to ChromaDB
-collection.add(
-    ids=all_ids,
-    documents=all_texts,
-    embeddings=all_embeddings,
-    metadatas=all_metadatas
-)
-
-print(f"Added {len(all_ids)} records to ChromaDB collection '{COLLECTION_NAME}'.")
\ No newline at end of file
+# 5) Helper: build the Chroma metadata stored alongside each record
+def record_to_metadata(record: dict, record_type: str) -> dict:
+    """
+    Return the flat metadata dict for a record. Nested values are serialized
+    to JSON strings because Chroma only accepts scalar metadata values.
+    """
+    if record_type == "transaction":
+        return {
+            "record_type": "transaction",
+            "user_id": record.get("user_id", ""),
+            "category": record.get("category", ""),
+            "currency": record.get("currency", ""),
+            "timestamp": record.get("timestamp", ""),
+            "amount": record.get("amount", 0.0),
+            "merchant_name": record.get("merchant_name", ""),
+            "is_recurring": bool(record.get("recurrence", {}).get("is_recurring", False)),
+        }
+
+    elif record_type == "offer":
+        return {
+            "record_type": "offer",
+            "name": record.get("name", ""),
+            "description": record.get("description", ""),
+            "type": record.get("type", ""),
+            "applicable_categories": ", ".join(record.get("applicable_categories", [])),
+            "minimum_transaction_amount": record.get("minimum_transaction_amount", 0),
+            "discount_value": json.dumps(record.get("discount_value", {})),
+            # eligibility constraints, kept scalar so they can be filtered on
+            "valid_from": record.get("validity_period", {}).get("start_date", ""),
+            "valid_until": record.get("validity_period", {}).get("end_date", record.get("expiry_date", "")),
+            "spending_threshold": record.get("targeting_rules", {}).get("user_spending_threshold", 0),
+            "risk_profile": record.get("targeting_rules", {}).get("risk_profile", ""),
+        }
+
+    elif record_type == "financial_asset":
+        return {
+            "record_type": "financial_asset",
+            "name": record.get("name", ""),
+            "type": record.get("type", ""),
+            "issuer": record.get("issuer", ""),
+            "risk_rating": record.get("risk_rating", ""),
+            "expected_return": record.get("expected_return", 0),
+        }
+
+    elif record_type == "investment_strategy":
+        return {
+            "record_type": "investment_strategy",
+            "name": record.get("name", ""),
+            "risk_profile": record.get("risk_profile", ""),
+            "time_horizon": record.get("time_horizon", ""),
+            "target_annual_return": record.get("target_annual_return", 0),
+            "allocation_blueprint": json.dumps(record.get("allocation_blueprint", {})),
+            "performance_metrics": json.dumps(record.get("performance_metrics", {}))
+        }
+
+    else:
+        return {"record_type": record_type}
+
+# 6) Streaming readers: yield (section, record) pairs without loading the whole file
+RECORD_TYPE_SECTIONS = {record_type: section for section, (record_type, _, _) in SECTIONS.items()}
+
+def infer_section(record: dict):
+    """Return the top-level section a bare record belongs to, or None."""
+    record_type = record.get("record_type")
+    if record_type in RECORD_TYPE_SECTIONS:
+        return RECORD_TYPE_SECTIONS[record_type]
+    for section, (_, _, id_field) in SECTIONS.items():
+        if id_field in record:
+            return section
+    return None
+
+def iter_jsonl(path: str):
+    """
+    Read one record per line. The section is taken from an explicit
+    "record_type" field, or inferred from the record's ID field.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            section = infer_section(record)
+            if section is None:
+                print(f"Skipping line {line_no}: unknown record type")
+                continue
+            yield section, record
+
+# Characters that can continue a JSON number
+NUMBER_CHARS = "0123456789.eE+-"
+
+class _JSONStream:
+    """Minimal incremental reader over a text file for json.JSONDecoder.raw_decode."""
+
+    def __init__(self, f, read_size: int):
+        self.f = f
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.read_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop the consumed prefix so the buffer only holds unread text
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ('' at end of file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Malformed JSON: expected {char!r} near offset {self.pos}")
+        self.pos += 1
+
+    def decode(self):
+        """Decode the next complete JSON value, reading more text as needed."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut off by the read decodes as a shorter number (and
+            # "12." as 12), so a value followed by nothing but characters that
+            # could extend a number is only taken once more text is read
+            if not self.buf[end:].strip(NUMBER_CHARS) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+def iter_json_sections(path: str, read_size: int = 1 << 16):
+    """
+    Incrementally parse a '{"transactions": [...], "offers": [...], ...}'
+    file, yielding records one at a time, section by section. Only one
+    record (plus a read buffer) is held in memory at once.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        stream = _JSONStream(f, read_size)
+        stream.expect("{")
+        while True:
+            char = stream.peek()
+            if char == "}":
+                return
+            if char == ",":
+                stream.pos += 1
+                continue
+            section = stream.decode()
+            stream.expect(":")
+            if stream.peek() != "[" or section not in SECTIONS:
+                stream.decode()  # not a record list: skip the whole value
+                continue
+            stream.expect("[")
+            while True:
+                char = stream.peek()
+                if char == "]":
+                    stream.pos += 1
+                    break
+                if char == ",":
+                    stream.pos += 1
+                    continue
+                if char == "":
+                    raise ValueError("Malformed JSON: unexpected end of file")
+                yield section, stream.decode()
+
+def iter_source(path: str):
+    """
+    Pick a streaming reader based on the file extension. A directory (e.g.
+    the sharded output of data_use_case_1.py) is read file by file in
+    name order.
+    """
+    if os.path.isdir(path):
+        return (
+            item
+            for name in sorted(os.listdir(path))
+            if name.endswith((".json", ".jsonl"))
+            for item in iter_source(os.path.join(path, name))
+        )
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path)
+    return iter_json_sections(path)
+
+# 7) Helper: turn (section, record) pairs into (id, text, metadata)
+# IDs are prefixed with their type, which is also how deletes are routed to partitions
+def content_hash(text: str, record: dict) -> str:
+    """Fingerprint of what gets embedded plus the record's update stamp."""
+    payload = f"{text}\x1f{record.get('updated_at', '')}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+def iter_records(source):
+    for section, record in source:
+        record_type, id_prefix, id_field = SECTIONS[section]
+        text = record_to_text(record, record_type)
+        metadata = record_to_metadata(record, record_type)
+        metadata["content_hash"] = content_hash(text, record)
+        yield id_prefix + record[id_field], text, metadata
+
+# 8) Incremental re-indexing: compare content hashes with what is already stored
+def load_existing_hashes(page_size: int = 5000) -> dict:
+    """Return {record id: content hash} for every record in the collection."""
+    hashes = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        for rec_id, metadata in zip(page["ids"], page["metadatas"]):
+            hashes[rec_id] = (metadata or {}).get("content_hash", "")
+        offset += len(page["ids"])
+    return hashes
+
+def skip_unchanged(records, existing_hashes: dict, stats: dict):
+    """
+    Drop records whose hash matches the stored one. Every ID seen in the
+    source is popped from 'existing_hashes', so whatever is left afterwards
+    no longer exists in the source.
+    """
+    for rec_id, text, metadata in records:
+        if existing_hashes.pop(rec_id, None) == metadata["content_hash"]:
+            stats["unchanged"] += 1
+            continue
+        yield rec_id, text, metadata
+
+def delete_missing(stale_ids, chunk_size: int = UPLOAD_CHUNK_SIZE) -> int:
+    """Delete records that disappeared from the source."""
+    stale_ids = list(stale_ids)
+    for i in range(0, len(stale_ids), chunk_size):
+        chunk = stale_ids[i:i + chunk_size]
+        collection.delete(ids=chunk)
+        if compact_index is not None:
+            compact_index.delete(chunk)
+        if lexical_index is not None:
+            lexical_index.delete(chunk)
+        if user_index is not None:
+            owners = user_index.owners(chunk).values()
+            dirty_users.update(owners)
+            user_index.delete(chunk)
+            eligibility.delete(chunk)
+            catalog.delete(chunk)
+            versions.bump_users(owners)
+            if any(rec_id.startswith(("off_", "strat_")) for rec_id in chunk):
+                versions.bump_catalog()
+    return len(stale_ids)
+
+def update_side_stores(ids: list, metadatas: list, embeddings) -> None:
+    """
+    Mirror a written chunk into the user index, the offer eligibility
+    table and the catalog store, and fold new transactions into their
+    users' profiles. Transactions that were already indexed (i.e.
+    changed) mark both their old and new owner for a full profile
+    recompute at the end of the run. Version counters are bumped for every
+    affected user, and for the catalog if offers or strategies changed.
+    """
+    if any(metadata["record_type"] in CATALOG_RECORD_TYPES for metadata in metadatas):
+        eligibility.upsert(zip(ids, metadatas))
+        versions.bump_catalog()
+    catalog.upsert(ids, metadatas, embeddings)
+    transactions = [
+        (i, rec_id, metadata)
+        for i, (rec_id, metadata) in enumerate(zip(ids, metadatas))
+        if metadata["record_type"] == "transaction"
+    ]
+    if not transactions:
+        return
+    owners = user_index.owners([rec_id for _, rec_id, _ in transactions])
+    user_index.upsert((rec_id, metadata) for _, rec_id, metadata in transactions)
+    profiles.add_transactions(
+        (metadata, embeddings[i]) for i, rec_id, metadata in transactions if rec_id not in owners
+    )
+    for _, rec_id, metadata in transactions:
+        if rec_id in owners:
+            dirty_users.add(owners[rec_id])
+            dirty_users.add(metadata["user_id"])
+    versions.bump_users([metadata["user_id"] for _, _, metadata in transactions] + list(owners.values()))
+
+# 9) Encoding: in-process, or sharded across a pool of worker processes
+def encode(texts: list, batch_size: int = ENCODE_BATCH_SIZE):
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        show_progress_bar=False,
+        convert_to_numpy=True
+    )
+
+def _init_worker(threads: int) -> None:
+    load_model(threads)
+
+def iter_chunks(records, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Group (id, text, metadata) records into (ids, texts, metadatas) chunks."""
+    ids, texts, metadatas = [], [], []
+    # reading, parsing and building the text of a chunk's records
+    start = time.perf_counter()
+    for rec_id, text, metadata in records:
+        ids.append(rec_id)
+        texts.append(text)
+        metadatas.append(metadata)
+        if len(ids) >= chunk_size:
+            metrics.observe("ingest.read", time.perf_counter() - start)
+            yield ids, texts, metadatas
+            ids, texts, metadatas = [], [], []
+            start = time.perf_counter()
+    if ids:
+        metrics.observe("ingest.read", time.perf_counter() - start)
+        yield ids, texts, metadatas
+
+def encode_chunks(chunks, batch_size: int = ENCODE_BATCH_SIZE):
+    for ids, texts, metadatas in chunks:
+        with metrics.span("ingest.encode"):
+            if cache is None:
+                embeddings = encode(texts, batch_size)
+            else:
+                embeddings = cache.get_or_compute(texts, lambda missing: encode(missing, batch_size))
+        yield ids, texts, metadatas, embeddings
+
+def encode_chunks_in_pool(chunks, workers: int, threads_per_worker: int,
+                          batch_size: int = ENCODE_BATCH_SIZE):
+    """
+    Encode chunks on 'workers' processes, each holding its own model limited
+    to 'threads_per_worker' torch threads. Results are yielded in input
+    order, and at most two chunks per worker are in flight so memory stays
+    bounded however long the input is. Cache lookups and writes happen
+    here in the parent; only the misses are sent to the workers.
+    """
+    def finish(item):
+        ids, texts, metadatas, embeddings, misses, result = item
+        if result is None:
+            return ids, texts, metadatas, embeddings
+        # time the writer waits for a worker, not the workers' own encode time
+        with metrics.span("ingest.encode_wait"):
+            computed = result.get()
+        if cache is None:
+            return ids, texts, metadatas, computed
+        embeddings[misses] = computed
+        cache.store([texts[i] for i in misses], computed)
+        return ids, texts, metadatas, embeddings
+
+    # spawn rather than fork: forking a process that has already imported
+    # torch can deadlock its thread pools
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+        pending = deque()
+        for ids, texts, metadatas in chunks:
+            if cache is None:
+                embeddings, misses = None, list(range(len(texts)))
+            else:
+                embeddings, misses = cache.lookup(texts)
+            missing = [texts[i] for i in misses]
+            result = pool.apply_async(encode, (missing, batch_size)) if missing else None
+            pending.append((ids, texts, metadatas, embeddings, misses, result))
+            if len(pending) >= 2 * workers:
+                yield finish(pending.popleft())
+        while pending:
+            yield finish(pending.popleft())
+
+def ingest(records, batch_size: int = ENCODE_BATCH_SIZE, chunk_size: int = UPLOAD_CHUNK_SIZE,
+           workers: int = 1, threads_per_worker: int = 0) -> int:
+    """
+    Encode and upsert 'records' chunk by chunk so that only a bounded number
+    of chunks (texts and embeddings) are held in memory at any time. This
+    process is the single writer; with workers > 1 encoding happens in a
+    process pool. Returns the number of records written.
+    """
+    chunks = iter_chunks(records, chunk_size)
+    if workers > 1:
+        if threads_per_worker <= 0:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        encoded = encode_chunks_in_pool(chunks, workers, threads_per_worker, batch_size)
+    else:
+        encoded = encode_chunks(chunks, batch_size)
+
+    total = 0
+    start = time.perf_counter()
+
+    for ids, texts, metadatas, embeddings in encoded:
+        with metrics.span("ingest.chroma_upsert"):
+            collection.upsert(
+                ids=ids,
+                documents=texts,
+                embeddings=embeddings.tolist(),
+                metadatas=metadatas
+            )
+        if user_index is not None:
+            with metrics.span("ingest.side_stores"):
+                update_side_stores(ids, metadatas, embeddings)
+        if compact_index is not None:
+            with metrics.span("ingest.compact_index"):
+                compact_index.upsert(ids, embeddings, [metadata["record_type"] for metadata in metadatas])
+        if lexical_index is not None:
+            with metrics.span("ingest.lexical_index"):
+                lexical_index.upsert(ids, texts)
+        total += len(ids)
+        elapsed = time.perf_counter() - start
+        print(f"  {total} records written ({total / elapsed:.1f} records/sec)")
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"Ingested {total} records in {elapsed:.2f}s ({rate:.1f} records/sec)")
+    return total
+
+# 10) Stream, embed and upsert all documents into ChromaDB
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed financial records into ChromaDB.")
+    parser.add_argument("input", nargs="?", default=JSON_PATH,
+                        help="JSON file with top-level sections, a .jsonl file with one record per line, "
+                             "or a directory of such files")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE,
+                        help="texts per forward pass of the model")
+    parser.add_argument("--chunk-size", type=int, default=UPLOAD_CHUNK_SIZE,
+                        help="records per collection.upsert() call")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-embed changed records and delete records missing from the input")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="encoder processes, each with its own model (1 = encode in this process)")
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch threads per encoder process (default: CPU count / workers)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="always run the model instead of reusing cached embeddings")
+    parser.add_argument("--compact-index", choices=["int8", "float16"],
+                        help="also write vectors to a quantized compact index of this type "
+                             "(build it with a full, non-incremental run)")
+    parser.add_argument("--lexical-index", action="store_true",
+                        help="also build a BM25 index of the embedded text for hybrid search "
+                             "(build it with a full, non-incremental run)")
+    parser.add_argument("--metrics", metavar="PATH", default=metrics.EXPORT_PATH,
+                        help="write per-stage timings to PATH: JSON if it ends in .json, "
+                             "otherwise Prometheus text (default: METRICS_EXPORT_PATH)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    open_collection()
+    user_index = resources.get_user_index()
+    profiles = resources.get_profiles()
+    versions = resources.get_versions()
+    eligibility = resources.get_offer_eligibility()
+    catalog = resources.get_catalog_store()
+    if not args.no_cache:
+        cache = resources.get_embedding_cache()
+    if args.compact_index or resources.has_compact_index():
+        # once built, keep it in step with the collection
+        compact_index = resources.get_compact_index(args.compact_index or "int8")
+    if args.lexical_index or resources.has_lexical_index():
+        lexical_index = resources.get_lexical_index()
+    if args.workers <= 1:
+        load_model(args.threads_per_worker)
+
+    records = iter_records(iter_source(args.input))
+    if args.incremental:
+        existing_hashes = load_existing_hashes()
+        stats = {"unchanged": 0}
+        records = skip_unchanged(records, existing_hashes, stats)
+
+    # the catalog store rewrites a whole table per write, so it is written once, after the run
+    with catalog.batch() as catalog_written:
+        added = ingest(
+            records,
+            batch_size=args.batch_size,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker
+        )
+
+        print(f"Upserted {added} records into the '{COLLECTION_NAME}' ChromaDB partitions.")
+        if args.incremental:
+            removed = delete_missing(existing_hashes, chunk_size=args.chunk_size)
+            print(f"Skipped {stats['unchanged']} unchanged records, deleted {removed} stale records.")
+    if catalog_written:
+        # bump again so no answer cached against the old catalog tables survives
+        versions.bump_catalog()
+    if dirty_users:
+        profiles.rebuild_users(dirty_users, user_index, collection)
+        # bump again so nothing cached from a half-rebuilt profile survives
+        versions.bump_users(dirty_users)
+        print(f"Recomputed {len(dirty_users)} user profiles.")
+    if args.metrics:
+        print(f"Wrote stage timings to {metrics.export(args.metrics)}")
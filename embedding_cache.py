@@ -0,0 +1,219 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Sequence, Tuple
+
+import numpy as np
+
+import resources
+
+# Shared by embedding.py, query_collection.py and financial_assistant.py
+DEFAULT_CACHE_DIR = resources.EMBEDDING_CACHE_DIR
+DEFAULT_CAPACITY = int(os.getenv("EMBEDDING_CACHE_CAPACITY", "100000"))  # vectors per model
+DEFAULT_DIM = 384                                                        # all-MiniLM-L6-v2
+# Hits are remembered in memory and written to the LRU index in batches of
+# this many, or when this many seconds have passed since the last write
+TOUCH_BATCH = 1000
+TOUCH_INTERVAL = 30.0
+
+
+class EmbeddingCache:
+    """
+    Content-addressed, disk-backed cache of embedding vectors.
+
+    Vectors live in a fixed-size float32 memory-mapped array; a small SQLite
+    index maps sha1(model name + text) to a slot in that array and tracks
+    when each entry was last used. When the array is full the least
+    recently used entries are evicted and their slots reused.
+
+    Lookups take no database lock. Next to each vector is a tag derived
+    from its key, cleared while the slot is rewritten; a lookup that does
+    not find its own tag before and after reading the vector (because
+    another process evicted and reused the slot meanwhile) is a miss.
+    Last-used times of hits are written back in batches.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                 capacity: int = DEFAULT_CAPACITY, dim: int = DEFAULT_DIM):
+        self.model_name = model_name
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()        # writes (store, LRU updates)
+        self._read_lock = threading.Lock()   # the lookup connection
+        self._touched = {}                   # key -> last hit not yet in the index
+        self._touched_at = time.monotonic()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = model_name.replace("/", "__")
+        vectors_path = os.path.join(cache_dir, f"{safe_name}.f32")
+        tags_path = os.path.join(cache_dir, f"{safe_name}.tags")
+        index_path = os.path.join(cache_dir, f"{safe_name}.sqlite3")
+
+        if os.path.exists(vectors_path):
+            # Keep the capacity the file was created with
+            capacity = os.path.getsize(vectors_path) // (dim * 4)
+            self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+        else:
+            self.vectors = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(capacity, dim))
+        self.capacity = capacity
+        # a cache written before tags existed starts with every tag cleared,
+        # so its entries miss once and are stored again
+        self.tags = np.memmap(tags_path, dtype=np.uint64, mode="r+" if os.path.exists(tags_path) else "w+",
+                              shape=(capacity,))
+
+        self.db = sqlite3.connect(index_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.read_db = sqlite3.connect(index_path, timeout=30, check_same_thread=False, isolation_level=None)
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _tag(key: str) -> int:
+        # never 0, which marks a slot being written
+        return int(key[:16], 16) | 1
+
+    @staticmethod
+    def _select_slots(db: sqlite3.Connection, keys) -> dict:
+        slots = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+            batch = keys[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            slots.update(db.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch
+            ).fetchall())
+        return slots
+
+    def _flush_touched(self) -> None:
+        """Write buffered last-used times to the index; caller holds the lock."""
+        if not self._touched:
+            return
+        touched, self._touched = self._touched, {}
+        self._touched_at = time.monotonic()
+        self.db.executemany(
+            "UPDATE entries SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in touched.items()]
+        )
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Return an array with one row per text, filled in for cache hits,
+        and the positions of the texts that missed.
+        """
+        result = np.zeros((len(texts), self.dim), dtype=np.float32)
+        keys = [self.key(text) for text in texts]
+        with self._read_lock:
+            slots = self._select_slots(self.read_db, set(keys))
+
+        misses = []
+        hit_keys = []
+        for i, key in enumerate(keys):
+            slot = slots.get(key)
+            if slot is not None:
+                tag = self._tag(key)
+                if self.tags[slot] == tag:
+                    result[i] = self.vectors[slot]
+                    # still ours after the read, so no other process reused the slot meanwhile
+                    if self.tags[slot] == tag:
+                        hit_keys.append(key)
+                        continue
+            misses.append(i)
+
+        now = time.time()
+        with self._lock:
+            self.hits += len(texts) - len(misses)
+            self.misses += len(misses)
+            self._touched.update((key, now) for key in hit_keys)
+            flush = (len(self._touched) >= TOUCH_BATCH
+                     or self._touched and time.monotonic() - self._touched_at >= TOUCH_INTERVAL)
+            if flush:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self._flush_touched()
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+        return result, misses
+
+    def store(self, texts: Sequence[str], vectors) -> None:
+        """Insert (or refresh) vectors for 'texts', evicting LRU entries if full."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            entries[self.key(text)] = vector
+        if not entries:
+            return
+
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so concurrent processes
+            # cannot hand out the same slot twice
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # recent hits first, so they are not mistaken for least recently used
+                self._flush_touched()
+                existing = self._select_slots(self.db, entries)
+                new_keys = [key for key in entries if key not in existing][:self.capacity]
+
+                # Slots are handed out densely from 0 and evicted slots are
+                # reused straight away, so the first free slot is the count
+                used = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                free_slots = list(range(used, min(self.capacity, used + len(new_keys))))
+                shortfall = len(new_keys) - len(free_slots)
+                if shortfall > 0:
+                    # entries refreshed by this call keep their slots, so they are not eviction candidates
+                    candidates = self.db.execute(
+                        "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (shortfall + len(existing),)
+                    ).fetchall()
+                    evicted = [(key, slot) for key, slot in candidates if key not in existing][:shortfall]
+                    self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    free_slots.extend(slot for _, slot in evicted)
+
+                now = time.time()
+                rows = [(key, slot, now) for key, slot in zip(new_keys, free_slots)]
+                rows += [(key, slot, now) for key, slot in existing.items()]
+                # clear each tag before rewriting its vector, so concurrent lookups miss instead
+                # of reading half-written or reassigned slots
+                for key, slot, _ in rows:
+                    self.tags[slot] = 0
+                    self.vectors[slot] = entries[key]
+                    self.tags[slot] = self._tag(key)
+                self.vectors.flush()
+                self.tags.flush()
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows
+                )
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def get_or_compute(self, texts: Sequence[str], compute: Callable[[List[str]], object]) -> np.ndarray:
+        """
+        Return embeddings for 'texts', calling 'compute' only for the texts
+        that are not cached yet.
+        """
+        result, misses = self.lookup(texts)
+        if misses:
+            missing_texts = [texts[i] for i in misses]
+            computed = np.asarray(compute(missing_texts), dtype=np.float32)
+            result[misses] = computed
+            self.store(missing_texts, computed)
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
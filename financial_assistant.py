@@ -1,67 +1,261 @@
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.chat_models import AzureChatOpenAI
 from langchain.prompts import PromptTemplate
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+import asyncio
 import json
 import os
-from typing import List, Dict, Any
+import queue
+from collections import Counter
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Dict, Any, AsyncIterator, Callable, Iterable, Iterator, Optional, Tuple
+import time
+import numpy as np
 from dotenv import load_dotenv
+import metrics
+import query_collection
+import resources
+from answer_cache import SemanticAnswerCache
+from context_compression import ContextCompressor
+from embedding_cache import EmbeddingCache
+from llm_backends import DEFAULT_SUMMARY, LLM_BACKEND, FakeChatModel
+from result_cache import TTLCache
+from session_memory import DEFAULT_SESSION, SUMMARY_PROMPT, SessionMemory, format_turns
 
 # Load environment variables
 load_dotenv()
 
-class TransactionAssistant:
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain embeddings backed by the process-wide SentenceTransformer.
+    Repeated texts are served from an EmbeddingCache, and the model itself
+    is only loaded the first time a text misses the cache. 'encode' can
+    replace the model's own encode, e.g. with a micro-batching encoder.
+    """
+
+    def __init__(self, cache: EmbeddingCache, encode: Optional[Callable[[List[str]], Any]] = None):
+        self.cache = cache
+        self.encode = encode
+
+    def _encode(self, texts: List[str]):
+        # same preprocessing as HuggingFaceEmbeddings
+        texts = [text.replace("\n", " ") for text in texts]
+        encode = self.encode or resources.get_model().encode
+        return encode(texts)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.get_or_compute(texts, self._encode).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class PartitionRetriever(BaseRetriever):
+    """
+    Retriever over the partitioned collection: the nearest 'k' records
+    across every record-type partition, fused with BM25 matches when the
+    lexical index exists (see query_collection.query_by_text).
+
+    With a 'compressor' the records come back as a single document holding
+    the packed context, with the compressor's report as its metadata.
+    """
+
+    embeddings: Any
+    k: int = 4
+    compressor: Any = None
+
+    def _get_relevant_documents(self, query: str, *,
+                                run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # same preprocessing as CachedEmbeddings, so cached probes are shared
+        with metrics.span("chat.retrieve"):
+            results = query_collection.query_by_text(query.replace("\n", " "), self.k, encode=self.embeddings.encode)
+        if self.compressor is not None:
+            with metrics.span("chat.compress_context"):
+                context, report = self.compressor.compress(query, results["documents"][0])
+            return [Document(page_content=context, metadata=report)]
+        return [
+            Document(page_content=document, metadata=metadata)
+            for document, metadata in zip(results["documents"][0], results["metadatas"][0])
+        ]
+
+
+# Tag carried by the LLM that writes the final answer, so streaming only
+# forwards its tokens and not those of the question-condensing call
+ANSWER_LLM_TAG = "qa_answer"
+
+class _AnswerTokenHandler(BaseCallbackHandler):
+    """Passes each token of the answer LLM call to 'emit' as it arrives."""
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.answer_runs = set()
+        self.emitted = 0
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        if tags and ANSWER_LLM_TAG in tags:
+            self.answer_runs.add(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, tags=tags)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self.answer_runs and token:
+            self.emitted += 1
+            self.emit(token)
+
+
+class _LLMTimingHandler(BaseCallbackHandler):
+    """Records each LLM call as "chat.llm.answer" or "chat.llm.condense"."""
+
     def __init__(self):
+        self.runs = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        stage = "chat.llm.answer" if tags and ANSWER_LLM_TAG in tags else "chat.llm.condense"
+        self.runs[run_id] = (stage, time.perf_counter())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, tags=tags)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage, start = self.runs.pop(run_id, (None, None))
+        if stage is not None:
+            metrics.observe(stage, time.perf_counter() - start)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.runs.pop(run_id, None)
+
+
+def _chain_callbacks(*handlers) -> List[BaseCallbackHandler]:
+    """Callbacks for one qa_chain call, plus LLM timing when metrics are on."""
+    return list(handlers) + ([_LLMTimingHandler()] if metrics.enabled() else [])
+
+
+class TransactionAssistant:
+    def __init__(self, llm_backend: Optional[str] = None,
+                 encode: Optional[Callable[[List[str]], Any]] = None):
+        # imported here so that importing this module stays cheap
+        from langchain.chains import ConversationalRetrievalChain
+        from langchain_community.chat_models import AzureChatOpenAI
+        
+        # "azure" talks to Azure OpenAI; "fake" uses the offline FakeChatModel
+        self.llm_backend = llm_backend or LLM_BACKEND
+        if self.llm_backend not in ("azure", "fake"):
+            raise ValueError(f"Unknown LLM backend: {self.llm_backend}")
         
         openai_api_key = os.getenv("OPENAI_API_KEY")
         openai_api_base = os.getenv("OPENAI_DEPLOYMENT_ENDPOINT")
         deployment_name = os.getenv("OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
         
-        if not all([openai_api_key, openai_api_base]):
+        if self.llm_backend == "azure" and not all([openai_api_key, openai_api_base]):
             raise ValueError("OPENAI_API_KEY and OPENAI_DEPLOYMENT_ENDPOINT environment variables must be set")
             
         # storing
         self.openai_api_key = openai_api_key
-        self.openai_api_base = openai_api_base.rstrip('/') 
+        self.openai_api_base = openai_api_base.rstrip('/') if openai_api_base else None
         
-        #embedding model
-        self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+        #embedding model, loaded on first use, with repeated probes served from the shared on-disk cache
+        self.embeddings = CachedEmbeddings(resources.get_embedding_cache(), encode)
         
-        # existing vdb from chroma
-        self.vectorstore = Chroma(
-            persist_directory="./chroma_db",
-            embedding_function=self.embeddings,
-            collection_name="financial_data"
+        # existing vdb from chroma, one partition per record type, shared with the rest of the process
+        self.collection = resources.get_collection()
+        
+        # exact user_id -> transactions index, rebuilt from Chroma metadata if missing
+        self.user_index = resources.get_user_index()
+        if self.user_index.count() == 0:
+            self.user_index.rebuild(self.collection)
+        
+        # per-user spending profiles maintained by embedding.py
+        self.profiles = resources.get_profiles()
+        if self.profiles.count() == 0 and self.user_index.count() > 0:
+            self.profiles.rebuild(self.collection)
+        
+        # structured offer constraints, used to drop ineligible offers before ranking
+        self.eligibility = resources.get_offer_eligibility()
+        if self.eligibility.count() == 0:
+            self.eligibility.rebuild(self.collection)
+        # offers, strategies and assets in typed columns, ranked and hydrated
+        # without fetching or parsing Chroma metadata per request
+        self.catalog = resources.get_catalog_store()
+        if self.catalog.count() == 0:
+            self.catalog.rebuild(self.collection)
+        # date offers must be valid on; defaults to today
+        self.offers_as_of = os.getenv("RECOMMENDATION_AS_OF")
+        
+        # recommendation results, keyed by user and the index versions that
+        # embedding.py bumps, so re-ingesting a user's data invalidates them
+        self.versions = resources.get_versions()
+        self.recommendation_cache = TTLCache(
+            maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000")),
+            ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
         )
+        # chat answers for questions that name a user, reused for
+        # near-duplicate questions under the same versions
+        self.answer_cache = SemanticAnswerCache()
         
         try:
-            # Initialize model
-            self.llm = AzureChatOpenAI(
-                openai_api_version="2023-05-15",
-                azure_deployment=deployment_name,
-                azure_endpoint=self.openai_api_base,
-                api_key=openai_api_key,
-                temperature=0.7 
-            )
+            # Initialize model; the answer model streams tokens, while the
+            # question-condensing step (and history summaries) use a plain client
+            if self.llm_backend == "fake":
+                self.llm = FakeChatModel.from_env(streaming=True, tags=[ANSWER_LLM_TAG])
+                self.condense_llm = FakeChatModel.from_env(echo=True)
+                # echoing would return the whole summary prompt as the summary
+                self.summary_llm = FakeChatModel.from_env(responses=[DEFAULT_SUMMARY])
+            else:
+                self.llm = AzureChatOpenAI(
+                    openai_api_version="2023-05-15",
+                    azure_deployment=deployment_name,
+                    azure_endpoint=self.openai_api_base,
+                    api_key=openai_api_key,
+                    temperature=0.7,
+                    streaming=True,
+                    tags=[ANSWER_LLM_TAG]
+                )
+                self.condense_llm = AzureChatOpenAI(
+                    openai_api_version="2023-05-15",
+                    azure_deployment=deployment_name,
+                    azure_endpoint=self.openai_api_base,
+                    api_key=openai_api_key,
+                    temperature=0.7
+                )
+                self.summary_llm = self.condense_llm
         except Exception as e:
             raise ValueError(f"Failed, Error: {str(e)}")
         
-        # Initialize conversation memory to maintain chat history
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Chat history per session within a token budget; older turns are
+        # summarized by 'summary_llm' (the condensing model, for Azure). The
+        # chain has no memory of its own: each call is given its session's
+        # history as 'chat_history'
+        self.memory = SessionMemory(self._summarize)
+        
+        # Retrieved records are trimmed, deduplicated and packed into a token
+        # budget before they reach the prompt; each response's
+        # "source_documents" carries that request's report
+        self.context_compressor = ContextCompressor()
         
         # Create the conversational chain for Q&A
         self.qa_chain = ConversationalRetrievalChain.from_llm(
             llm=self.llm,
-            retriever=self.vectorstore.as_retriever(),
-            memory=self.memory,
+            condense_question_llm=self.condense_llm,
+            retriever=PartitionRetriever(embeddings=self.embeddings, compressor=self.context_compressor),
+            return_source_documents=True,
             combine_docs_chain_kwargs={"prompt": self._get_qa_prompt()}
         )
 
+    def model_seconds(self) -> Optional[float]:
+        """Simulated LLM time spent so far with the fake backend; None for real models."""
+        if self.llm_backend != "fake":
+            return None
+        return self.llm.model_seconds + self.condense_llm.model_seconds + self.summary_llm.model_seconds
+
+    def _summarize(self, summary: str, turns: List[Tuple[str, str]]) -> str:
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(none)", lines=format_turns(turns))
+        return self.summary_llm.invoke(prompt).content
+
     def _get_qa_prompt(self) -> PromptTemplate:
         template = """You are a helpful financial assistant specializing in transaction analysis. 
         Use the following pieces of context to answer the question at the end.
@@ -80,117 +274,443 @@ class TransactionAssistant:
             template=template
         )
 
-    def get_transaction_recommendations(self, user_id: str) -> Dict[str, List[Dict[str, Any]]]:
-        
-        user_transactions = self.vectorstore.similarity_search(
-            f"user_id: {user_id}",
-            k=5, 
-            filter={"record_type": "transaction"}
-        )
+    def _as_of(self) -> str:
+        return self.offers_as_of or datetime.now().isoformat()
+
+    @metrics.timed("get_transaction_recommendations")
+    def get_transaction_recommendations(self, user_id: str, since: Optional[str] = None,
+                                        until: Optional[str] = None,
+                                        risk_profile: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Return offers and strategies for a user, served from the result
+        cache while neither the user's data nor the catalog has changed.
+        Only offers the user is eligible for are considered; 'risk_profile'
+        additionally restricts them to offers targeting that profile.
+        The returned dict is shared with the cache and must not be mutated.
+        """
+        # offers expire, so results are only reused on the same day
+        key = (user_id, since, until, risk_profile, self._as_of()[:10], *self.versions.get(user_id))
+        recommendations = self.recommendation_cache.get(key)
+        if recommendations is None:
+            recommendations = self._compute_recommendations(user_id, since, until, risk_profile)
+            self.recommendation_cache.set(key, recommendations)
+        return recommendations
+
+    def _compute_recommendations(self, user_id: str, since: Optional[str], until: Optional[str],
+                                 risk_profile: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
         
-        categories = [doc.metadata.get("category", "") for doc in user_transactions]
+        # full-history requests read the precomputed profile and search with
+        # its centroid embedding: one row read, no query embedding
+        with metrics.span("recommendations.profile"):
+            profile = self.profiles.get(user_id) if since is None and until is None else None
+        if profile is not None and profile["centroid"] is not None:
+            centroid = profile["centroid"].tolist()
+            offer_query = centroid
+            with metrics.span("recommendations.strategy_search"):
+                strategies = self._nearest(centroid, "investment_strategy", k=2)
+        else:
+            with metrics.span("recommendations.history"):
+                categories = self._history_categories(user_id, since, until)
+            
+            with metrics.span("recommendations.embed"):
+                offer_query = self.embeddings.embed_query(f"categories: {', '.join(categories)}")
+                strategy_query = self.embeddings.embed_query(f"spending patterns: {', '.join(categories)}")
+            
+            with metrics.span("recommendations.strategy_search"):
+                strategies = self._nearest(strategy_query, "investment_strategy", k=2)
         
+        with metrics.span("recommendations.eligible_offers"):
+            offer_ids = self._eligible_offers(user_id, since, until, risk_profile)
         
-        offers = self.vectorstore.similarity_search(
-            f"categories: {', '.join(categories)}",
-            k=3, 
-            filter={"record_type": "offer"}
+        return {
+            "offers": self._rank_offers(offer_query, offer_ids, k=3),
+            "strategies": strategies
+        }
+
+    def _nearest(self, query: List[float], record_type: str, k: int) -> List[Dict[str, Any]]:
+        """Details of the k catalog records of 'record_type' most similar to 'query'."""
+        table = self.catalog.table(record_type)
+        return table.records(table.search(query, k))
+
+    def _eligible_offers(self, user_id: str, since: Optional[str], until: Optional[str],
+                         risk_profile: Optional[str]) -> List[str]:
+        """IDs of the offers the user qualifies for, from indexed range lookups only."""
+        total_spend, largest_amount = self.user_index.spending(user_id, since=since, until=until)
+        return self.eligibility.eligible(
+            self._as_of(),
+            largest_amount=largest_amount,
+            total_spend=total_spend,
+            risk_profile=risk_profile
         )
+
+    def _rank_offers(self, query: List[float], offer_ids: List[str], k: int) -> List[Dict[str, Any]]:
+        """Score only the eligible offers against 'query' and return the best k."""
+        table = self.catalog.table("offer")
+        with metrics.span("recommendations.offer_rank"):
+            top = table.search(query, k, rows=table.rows(offer_ids))
+        with metrics.span("recommendations.details"):
+            return table.records(top)
+
+    def _history_categories(self, user_id: str, since: Optional[str], until: Optional[str]) -> List[str]:
+        # exact lookup of the user's history (optionally limited to an
+        # ISO-8601 time window); no embedding call is needed for this step
+        user_transactions = self.user_index.transactions(user_id, since=since, until=until)
         
+        # distinct categories, most frequent first
+        return [category for category, _ in Counter(
+            txn["category"] for txn in user_transactions if txn["category"]
+        ).most_common()]
+
+    @metrics.timed("aget_transaction_recommendations")
+    async def aget_transaction_recommendations(self, user_id: str, since: Optional[str] = None,
+                                               until: Optional[str] = None,
+                                               risk_profile: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Async get_transaction_recommendations: the offer and strategy
+        searches run concurrently, and blocking store reads are moved off
+        the event loop.
+        """
+        key = (user_id, since, until, risk_profile, self._as_of()[:10],
+               *await asyncio.to_thread(self.versions.get, user_id))
+        recommendations = self.recommendation_cache.get(key)
+        if recommendations is None:
+            recommendations = await self._acompute_recommendations(user_id, since, until, risk_profile)
+            self.recommendation_cache.set(key, recommendations)
+        return recommendations
+
+    async def _acompute_recommendations(self, user_id: str, since: Optional[str], until: Optional[str],
+                                        risk_profile: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
+        # the eligibility lookup overlaps with reading the profile
+        eligible_task = asyncio.create_task(
+            asyncio.to_thread(self._eligible_offers, user_id, since, until, risk_profile)
+        )
+        profile = None
+        if since is None and until is None:
+            profile = await asyncio.to_thread(self.profiles.get, user_id)
+        if profile is not None and profile["centroid"] is not None:
+            centroid = profile["centroid"].tolist()
+            offer_ids = await eligible_task
+            offers, strategies = await asyncio.gather(
+                asyncio.to_thread(self._rank_offers, centroid, offer_ids, 3),
+                asyncio.to_thread(self._nearest, centroid, "investment_strategy", 2)
+            )
+        else:
+            categories = await asyncio.to_thread(self._history_categories, user_id, since, until)
+            offer_query = await self.embeddings.aembed_query(f"categories: {', '.join(categories)}")
+            offer_ids = await eligible_task
+            offers, strategies = await asyncio.gather(
+                asyncio.to_thread(self._rank_offers, offer_query, offer_ids, 3),
+                self._anearest(f"spending patterns: {', '.join(categories)}", "investment_strategy", 2)
+            )
         
-        strategies = self.vectorstore.similarity_search(
-            f"spending patterns: {', '.join(categories)}",
-            k=2, 
-            filter={"record_type": "investment_strategy"}
+        return {"offers": offers, "strategies": strategies}
+
+    async def _anearest(self, text: str, record_type: str, k: int) -> List[Dict[str, Any]]:
+        query = await self.embeddings.aembed_query(text)
+        return await asyncio.to_thread(self._nearest, query, record_type, k)
+
+    def _load_catalog(self, record_type: str,
+                      ids: Optional[List[str]] = None) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray]:
+        """
+        Every record of 'record_type' (or only those of 'ids' in the
+        catalog store) as their IDs, hydrated details and an (n, dim)
+        matrix of their L2-normalised embeddings, all in the same order.
+        """
+        table = self.catalog.table(record_type)
+        rows = np.arange(len(table)) if ids is None else table.rows(ids)
+        if not len(rows):
+            return [], [], np.empty((0, 0), dtype=np.float32)
+        return [str(table.ids[row]) for row in rows], table.records(rows), np.asarray(table.embeddings[rows])
+
+    @staticmethod
+    def _rank(queries: np.ndarray, matrix: np.ndarray, k: int,
+              allowed: Optional[np.ndarray] = None) -> List[List[int]]:
+        """
+        Per query, the indices of the (at most) k catalog rows scoring
+        highest against it, best first. 'allowed' is an optional
+        (queries, rows) boolean mask of the rows each query may get.
+        """
+        k = min(k, len(matrix))
+        if k <= 0 or len(queries) == 0:
+            return [[] for _ in range(len(queries))]
+        scores = queries @ matrix.T
+        if allowed is not None:
+            scores[~allowed] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        valid = np.isfinite(np.take_along_axis(top_scores, order, axis=1))
+        return [row[keep].tolist() for row, keep in zip(top, valid)]
+
+    def bulk_recommendations(self, user_ids: Iterable[str], output_path: str,
+                             offer_k: int = 3, strategy_k: int = 2, batch_size: int = 4096,
+                             risk_profile: Optional[str] = None) -> int:
+        """
+        Score many users at once and stream one JSON line per user to
+        'output_path'. Offer and strategy vectors are loaded into matrices
+        once; each batch of users is scored with a single matrix multiply
+        of their profile centroids against each catalog (cosine
+        similarity) followed by a vectorized top-k. Users without a
+        profile get empty lists. As in get_transaction_recommendations(),
+        only offers valid today (and targeting 'risk_profile', if given)
+        that the user qualifies for are ranked: each user's largest
+        transaction and total spend are compared with every offer's
+        minimum amount and spending threshold as one mask per batch.
+        Returns the number of lines written.
+        """
+        offer_ids, offers, offer_matrix = self._load_catalog(
+            "offer", ids=self.eligibility.eligible(self._as_of(), risk_profile=risk_profile)
         )
+        minimums, thresholds = self.eligibility.amounts(offer_ids)
+        _, strategies, strategy_matrix = self._load_catalog("investment_strategy")
+
+        written = 0
+        user_ids = iter(user_ids)
+        with open(output_path, "w", encoding="utf-8") as out:
+            while True:
+                batch = list(islice(user_ids, batch_size))
+                if not batch:
+                    break
+                found, centroids = self.profiles.centroids(batch)
+                row_of = {user_id: row for row, user_id in enumerate(found)}
+
+                spending = self.user_index.spending_many(found)
+                total_spend = np.asarray([spending[user_id][0] for user_id in found], dtype=np.float64)
+                largest_amount = np.asarray([spending[user_id][1] for user_id in found], dtype=np.float64)
+                allowed = ((minimums[None, :] <= largest_amount[:, None])
+                           & (thresholds[None, :] <= total_spend[:, None]))
+
+                top_offers = self._rank(centroids, offer_matrix, offer_k, allowed)
+                top_strategies = self._rank(centroids, strategy_matrix, strategy_k)
+
+                for user_id in batch:
+                    row = row_of.get(user_id)
+                    out.write(json.dumps({
+                        "user_id": user_id,
+                        "offers": [offers[i] for i in top_offers[row]] if row is not None else [],
+                        "strategies": [strategies[i] for i in top_strategies[row]] if row is not None else []
+                    }) + "\n")
+                    written += 1
+        return written
+
+    @staticmethod
+    def _extract_user_id(question: str) -> Optional[str]:
+        if "user id is" in question.lower():
+            return question.lower().split("user id is")[1].split()[0].strip()
+        return None
+
+    @staticmethod
+    def _format_recommendations(recommendations: Optional[Dict[str, List[Dict[str, Any]]]]) -> str:
+        if not recommendations:
+            return ""
         
+        text = "\n\nPersonalized Recommendations:\n"
         
-        offer_details = []
-        for doc in offers:
-            metadata = doc.metadata
-            try:
-                discount_value = json.loads(metadata.get("discount_value", "{}"))
-            except:
-                discount_value = {}
-                
-            offer_data = {
-                "name": metadata.get("name", "Unnamed Offer"),
-                "description": metadata.get("description", "No description available"),
-                "type": metadata.get("type", "Unknown type"),
-                "discount_value": discount_value,
-                "applicable_categories": metadata.get("applicable_categories", "").split(", "),
-                "minimum_transaction_amount": metadata.get("minimum_transaction_amount", 0)
-            }
-            offer_details.append(offer_data)
-        
-        
-        strategy_details = []
-        for doc in strategies:
-            metadata = doc.metadata
-            try:
-                allocation_blueprint = json.loads(metadata.get("allocation_blueprint", "{}"))
-                performance_metrics = json.loads(metadata.get("performance_metrics", "{}"))
-            except:
-                allocation_blueprint = {}
-                performance_metrics = {}
-                
-            strategy_data = {
-                "name": metadata.get("name", "Unnamed Strategy"),
-                "risk_profile": metadata.get("risk_profile", "Not specified"),
-                "time_horizon": metadata.get("time_horizon", "Not specified"),
-                "target_annual_return": metadata.get("target_annual_return", 0),
-                "allocation_blueprint": allocation_blueprint,
-                "performance_metrics": performance_metrics
-            }
-            strategy_details.append(strategy_data)
+        if recommendations["offers"]:
+            text += "\nOffers for you:\n"
+            for offer in recommendations["offers"]:
+                text += f"- {offer['name']}: {offer['description']}\n"
+                text += f"  Type: {offer['type']}, "
+                if offer['discount_value']:
+                    discount = offer['discount_value']
+                    text += f"Discount: {discount.get('value', '')}{discount.get('type', '')}, "
+                text += f"Min. Amount: ₹{offer['minimum_transaction_amount']}\n"
         
-        return {
-            "offers": offer_details,
-            "strategies": strategy_details
-        }
+        if recommendations["strategies"]:
+            text += "\nInvestment Strategies:\n"
+            for strategy in recommendations["strategies"]:
+                text += f"- {strategy['name']}\n"
+                text += f"  Risk Profile: {strategy['risk_profile']}, "
+                text += f"Time Horizon: {strategy['time_horizon']}, "
+                text += f"Target Return: {strategy['target_annual_return']}%\n"
+                if strategy['allocation_blueprint']:
+                    text += "  Allocation: "
+                    allocations = [f"{k}: {v}%" for k, v in strategy['allocation_blueprint'].items()]
+                    text += ", ".join(allocations) + "\n"
+        
+        return text
 
-    def chat(self, question: str) -> str:
+    def _answer_key(self, question: str, user_id: Optional[str]) -> Optional[Tuple[np.ndarray, tuple]]:
+        """
+        (question embedding, version) for the answer cache. Only questions
+        that name a user are cached, since the answer is about their data;
+        cached answers are reused whatever the session's earlier turns were.
+        """
+        if not user_id:
+            return None
+        embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        wants_recommendations = "recommendations" in question.lower()
+        return embedding, (self._as_of()[:10], wants_recommendations, *self.versions.get(user_id))
+
+    @metrics.timed("chat")
+    def chat(self, question: str, session_id: str = DEFAULT_SESSION) -> str:
         
-        user_id = None
-        if "user id is" in question.lower():
-            user_id = question.lower().split("user id is")[1].split()[0].strip()
+        user_id = self._extract_user_id(question)
         
+        # a near-duplicate question skips retrieval and the LLM altogether
+        with metrics.span("chat.answer_cache"):
+            key = self._answer_key(question, user_id)
+            cached = self.answer_cache.get(user_id, *key) if key else None
+        if cached is not None:
+            answer, recommendations_text = cached
+            with metrics.span("chat.memory"):
+                self.memory.record(session_id, question, answer)
+            return answer + recommendations_text
         
         recommendations = None
         if "recommendations" in question.lower() and user_id:
             recommendations = self.get_transaction_recommendations(user_id)
         
-        
-        response = self.qa_chain({"question": question})
+        # condensing, retrieval, prompt building and the answer LLM call
+        with metrics.span("chat.qa_chain"):
+            response = self.qa_chain(
+                {"question": question, "chat_history": self.memory.history(session_id)},
+                callbacks=_chain_callbacks()
+            )
         answer = response["answer"]
+        with metrics.span("chat.memory"):
+            self.memory.record(session_id, question, answer)
+        
+        with metrics.span("chat.format"):
+            recommendations_text = self._format_recommendations(recommendations)
+        if key:
+            self.answer_cache.set(user_id, *key, (answer, recommendations_text))
+        return answer + recommendations_text
+
+    @metrics.timed("achat")
+    async def achat(self, question: str, session_id: str = DEFAULT_SESSION) -> str:
+        """
+        Async chat: recommendation retrieval overlaps with the LLM
+        round-trip instead of running before it, and many conversations
+        can be served from one event loop.
+        """
+        user_id = self._extract_user_id(question)
         
+        key = await asyncio.to_thread(self._answer_key, question, user_id)
+        cached = self.answer_cache.get(user_id, *key) if key else None
+        if cached is not None:
+            answer, recommendations_text = cached
+            await self.memory.arecord(session_id, question, answer)
+            return answer + recommendations_text
+        
+        answer_call = self.qa_chain.acall(
+            {"question": question, "chat_history": self.memory.history(session_id)}, callbacks=_chain_callbacks()
+        )
+        if "recommendations" in question.lower() and user_id:
+            response, recommendations = await asyncio.gather(
+                answer_call,
+                self.aget_transaction_recommendations(user_id)
+            )
+        else:
+            response, recommendations = await answer_call, None
+        await self.memory.arecord(session_id, question, response["answer"])
+        
+        recommendations_text = self._format_recommendations(recommendations)
+        if key:
+            self.answer_cache.set(user_id, *key, (response["answer"], recommendations_text))
+        return response["answer"] + recommendations_text
+
+    def stream_chat(self, question: str, session_id: str = DEFAULT_SESSION) -> Iterator[str]:
+        """
+        Like chat, but yields answer tokens as the LLM produces them,
+        followed by the "Personalized Recommendations" block, which is
+        computed on another thread while the answer streams.
+        """
+        user_id = self._extract_user_id(question)
+        key = self._answer_key(question, user_id)
+        cached = self.answer_cache.get(user_id, *key) if key else None
+        if cached is not None:
+            answer, recommendations_text = cached
+            self.memory.record(session_id, question, answer)
+            yield answer + recommendations_text
+            return
         
-        if recommendations:
-            answer += "\n\nPersonalized Recommendations:\n"
+        tokens = queue.Queue()
+        done = object()
+        handler = _AnswerTokenHandler(tokens.put)
+        
+        history = self.memory.history(session_id)
+        
+        def answer():
+            try:
+                response = self.qa_chain({"question": question, "chat_history": history},
+                                         callbacks=_chain_callbacks(handler))
+            finally:
+                tokens.put(done)
+            # any summarizing happens after the last answer token is out
+            self.memory.record(session_id, question, response["answer"])
+            return response
+        
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            recommendations_future = None
+            if "recommendations" in question.lower() and user_id:
+                recommendations_future = pool.submit(self.get_transaction_recommendations, user_id)
+            answer_future = pool.submit(answer)
+            
+            while True:
+                token = tokens.get()
+                if token is done:
+                    break
+                yield token
             
-            if recommendations["offers"]:
-                answer += "\nOffers for you:\n"
-                for offer in recommendations["offers"]:
-                    answer += f"- {offer['name']}: {offer['description']}\n"
-                    answer += f"  Type: {offer['type']}, "
-                    if offer['discount_value']:
-                        discount = offer['discount_value']
-                        answer += f"Discount: {discount.get('value', '')}{discount.get('type', '')}, "
-                    answer += f"Min. Amount: ₹{offer['minimum_transaction_amount']}\n"
+            response = answer_future.result()
+            if handler.emitted == 0:
+                # the model did not stream; fall back to the full answer
+                yield response["answer"]
+            recommendations_text = ""
+            if recommendations_future is not None:
+                recommendations_text = self._format_recommendations(recommendations_future.result())
+                yield recommendations_text
+            if key:
+                self.answer_cache.set(user_id, *key, (response["answer"], recommendations_text))
+
+    async def astream_chat(self, question: str, session_id: str = DEFAULT_SESSION) -> AsyncIterator[str]:
+        """Async stream_chat for use from an event loop."""
+        user_id = self._extract_user_id(question)
+        key = await asyncio.to_thread(self._answer_key, question, user_id)
+        cached = self.answer_cache.get(user_id, *key) if key else None
+        if cached is not None:
+            answer, recommendations_text = cached
+            await self.memory.arecord(session_id, question, answer)
+            yield answer + recommendations_text
+            return
+        
+        loop = asyncio.get_running_loop()
+        tokens = asyncio.Queue()
+        done = object()
+        # callbacks may fire on executor threads, so hop back onto the loop
+        handler = _AnswerTokenHandler(lambda token: loop.call_soon_threadsafe(tokens.put_nowait, token))
+        
+        recommendations_task = None
+        if "recommendations" in question.lower() and user_id:
+            recommendations_task = asyncio.create_task(self.aget_transaction_recommendations(user_id))
+        answer_task = asyncio.create_task(self.qa_chain.acall(
+            {"question": question, "chat_history": self.memory.history(session_id)}, callbacks=_chain_callbacks(handler)
+        ))
+        answer_task.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, done))
+        
+        try:
+            while True:
+                token = await tokens.get()
+                if token is done:
+                    break
+                yield token
             
-            if recommendations["strategies"]:
-                answer += "\nInvestment Strategies:\n"
-                for strategy in recommendations["strategies"]:
-                    answer += f"- {strategy['name']}\n"
-                    answer += f"  Risk Profile: {strategy['risk_profile']}, "
-                    answer += f"Time Horizon: {strategy['time_horizon']}, "
-                    answer += f"Target Return: {strategy['target_annual_return']}%\n"
-                    if strategy['allocation_blueprint']:
-                        answer += "  Allocation: "
-                        allocations = [f"{k}: {v}%" for k, v in strategy['allocation_blueprint'].items()]
-                        answer += ", ".join(allocations) + "\n"
-        
-        return answer
+            response = await answer_task
+            if handler.emitted == 0:
+                yield response["answer"]
+            recommendations_text = ""
+            if recommendations_task is not None:
+                recommendations_text = self._format_recommendations(await recommendations_task)
+                yield recommendations_text
+            await self.memory.arecord(session_id, question, response["answer"])
+            if key:
+                self.answer_cache.set(user_id, *key, (response["answer"], recommendations_text))
+        finally:
+            for task in (answer_task, recommendations_task):
+                if task is not None and not task.done():
+                    task.cancel()
 
 
 if __name__ == "__main__":
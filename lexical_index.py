@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import resources
+
+DEFAULT_INDEX_PATH = resources.LEXICAL_INDEX_PATH
+
+K1 = 1.2
+B = 0.75
+# postings read per query term; postings are stored impact-ordered, so the
+# best matches for a term are always among the first ones read
+POSTINGS_PER_TERM = int(os.getenv("LEXICAL_POSTINGS_PER_TERM", "2000"))
+
+# Words joined by "-" or "_" stay one token, so UUIDs and invoice numbers
+# can be matched exactly
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_][a-z0-9]+)*")
+# A token with a digit in it and at least this long looks like an identifier
+IDENTIFIER_MIN_LENGTH = 6
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def is_exact_query(text: str) -> bool:
+    """
+    Whether 'text' asks for an exact term rather than a meaning: it is
+    quoted, or is nothing but one ID-like token (a UUID, an invoice
+    number, ...). A question that merely mentions an ID is not.
+    """
+    stripped = text.strip()
+    if len(stripped) > 1 and stripped[0] == stripped[-1] and stripped[0] in "\"'":
+        return True
+    tokens = tokenize(stripped)
+    return (
+        len(tokens) == 1 and tokens[0] == stripped.lower()
+        and len(tokens[0]) >= IDENTIFIER_MIN_LENGTH and any(ch.isdigit() for ch in tokens[0])
+    )
+
+
+class BM25Index:
+    """
+    On-disk BM25 inverted index over the same text that gets embedded.
+
+    Postings are stored with their BM25 term weight (tf and length
+    normalisation, computed against the average document length when the
+    document was written) and indexed by (term, weight), so a query reads
+    only the strongest POSTINGS_PER_TERM postings of each of its terms and
+    multiplies them by the term's current IDF.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, record_id TEXT NOT NULL, weight REAL NOT NULL, "
+            "PRIMARY KEY (term, record_id)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS postings_impact ON postings (term, weight DESC)")
+        # each document's distinct terms, so it can be removed again
+        self.db.execute("CREATE TABLE IF NOT EXISTS documents (record_id TEXT PRIMARY KEY, length INTEGER, terms TEXT)")
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('documents', 0), ('total_length', 0)")
+        self.db.commit()
+
+    def _meta(self) -> Tuple[float, float]:
+        meta = dict(self.db.execute("SELECT key, value FROM meta").fetchall())
+        return meta["documents"], meta["total_length"]
+
+    def _remove(self, record_ids: Sequence[str]) -> None:
+        """Drop documents inside an open transaction; caller holds the lock."""
+        removed_docs = 0
+        removed_length = 0
+        df_changes: Counter = Counter()
+        for i in range(0, len(record_ids), 500):
+            batch = list(record_ids[i:i + 500])
+            rows = self.db.execute(
+                f"SELECT record_id, length, terms FROM documents WHERE record_id IN ({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for record_id, length, terms in rows:
+                terms = json.loads(terms)
+                self.db.executemany(
+                    "DELETE FROM postings WHERE term = ? AND record_id = ?", [(term, record_id) for term in terms]
+                )
+                df_changes.update(terms)
+                removed_docs += 1
+                removed_length += length
+            self.db.executemany("DELETE FROM documents WHERE record_id = ?", [(rid,) for rid in batch])
+        if df_changes:
+            self.db.executemany("UPDATE terms SET df = df - ? WHERE term = ?",
+                                [(count, term) for term, count in df_changes.items()])
+        # documents without any tokens count too, though they change no df
+        if removed_docs:
+            self.db.execute("UPDATE meta SET value = value - ? WHERE key = 'documents'", (removed_docs,))
+            self.db.execute("UPDATE meta SET value = value - ? WHERE key = 'total_length'", (removed_length,))
+
+    def upsert(self, record_ids: Sequence[str], texts: Sequence[str]) -> None:
+        """Index (or re-index) documents by record ID."""
+        documents = [(record_id, tokenize(text)) for record_id, text in zip(record_ids, texts)]
+        if not documents:
+            return
+        with self._lock:
+            try:
+                self._remove([record_id for record_id, _ in documents])
+                count, total_length = self._meta()
+                count += len(documents)
+                total_length += sum(len(tokens) for _, tokens in documents)
+                average_length = total_length / count if total_length else 1.0
+
+                postings = []
+                df_changes: Counter = Counter()
+                document_rows = []
+                for record_id, tokens in documents:
+                    frequencies = Counter(tokens)
+                    norm = K1 * (1 - B + B * len(tokens) / average_length)
+                    for term, tf in frequencies.items():
+                        postings.append((term, record_id, tf * (K1 + 1) / (tf + norm)))
+                    df_changes.update(frequencies.keys())
+                    document_rows.append((record_id, len(tokens), json.dumps(list(frequencies))))
+
+                self.db.executemany("INSERT INTO postings (term, record_id, weight) VALUES (?, ?, ?)", postings)
+                self.db.executemany(
+                    "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                    list(df_changes.items())
+                )
+                self.db.executemany("INSERT INTO documents (record_id, length, terms) VALUES (?, ?, ?)", document_rows)
+                self.db.execute("UPDATE meta SET value = ? WHERE key = 'documents'", (count,))
+                self.db.execute("UPDATE meta SET value = ? WHERE key = 'total_length'", (total_length,))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def delete(self, record_ids: Iterable[str]) -> None:
+        with self._lock:
+            try:
+                self._remove(list(record_ids))
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                raise
+
+    def search(self, text: str, k: int = 10,
+               accept: Optional[Callable[[str], bool]] = None) -> List[Tuple[str, float]]:
+        """
+        Return up to 'k' (record id, BM25 score) pairs, best first.
+        'accept', if given, is called with each record id to filter hits
+        (e.g. to one record type).
+        """
+        terms = list(dict.fromkeys(tokenize(text)))
+        if not terms:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            count, _ = self._meta()
+            placeholders = ", ".join("?" * len(terms))
+            frequencies = dict(self.db.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({placeholders}) AND df > 0", terms
+            ).fetchall())
+            for term, df in frequencies.items():
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for record_id, weight in self.db.execute(
+                    "SELECT record_id, weight FROM postings WHERE term = ? ORDER BY weight DESC LIMIT ?",
+                    (term, POSTINGS_PER_TERM)
+                ):
+                    if accept is None or accept(record_id):
+                        scores[record_id] = scores.get(record_id, 0.0) + idf * weight
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._meta()[0])
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import (
+    BaseChatModel,
+    agenerate_from_stream,
+    generate_from_stream,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Which LLM TransactionAssistant talks to: "azure" (default) or "fake"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "azure")
+
+DEFAULT_RESPONSES = [
+    "Based on your recent transactions, most of your spending is on dining and groceries, "
+    "with a few larger electronics purchases. Your recurring payments look consistent month to month.",
+    "You have made several other transactions, mainly with online merchants. "
+    "I don't see anything unusual in your history.",
+]
+
+# Canned running summary for session memory, so summaries stay a realistic,
+# fixed size instead of echoing (and nesting) the summary prompt
+DEFAULT_SUMMARY = (
+    "The user asked about their recent transactions and spending; the assistant described their "
+    "main spending categories and merchants and noted nothing unusual."
+)
+
+# Guards the call and timing counters of every FakeChatModel instance
+_counter_lock = threading.Lock()
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline, deterministic stand-in for the chat model. It waits
+    'first_token_latency' seconds, then emits whitespace-delimited tokens
+    at 'tokens_per_second', cycling through 'responses'. With 'echo' it
+    answers with the follow-up question it was given, which keeps the
+    question-condensing step of ConversationalRetrievalChain meaningful.
+
+    Time spent "in the model" is accumulated in 'model_seconds', so
+    callers can separate our own overhead from simulated LLM time.
+    """
+
+    responses: List[str] = DEFAULT_RESPONSES
+    first_token_latency: float = 0.5
+    tokens_per_second: float = 40.0
+    echo: bool = False
+    streaming: bool = False
+    calls: int = 0
+    model_seconds: float = 0.0
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "FakeChatModel":
+        """
+        Configure from FAKE_LLM_LATENCY (seconds to first token),
+        FAKE_LLM_TOKENS_PER_SEC and FAKE_LLM_RESPONSES (path to a JSON list
+        of canned answers); keyword arguments take precedence.
+        """
+        settings = {
+            "first_token_latency": float(os.getenv("FAKE_LLM_LATENCY", "0.5")),
+            "tokens_per_second": float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "40")),
+        }
+        responses_path = os.getenv("FAKE_LLM_RESPONSES")
+        if responses_path:
+            with open(responses_path, "r", encoding="utf-8") as f:
+                settings["responses"] = json.load(f)
+        settings.update(kwargs)
+        return cls(**settings)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _next_response(self, messages: List[BaseMessage]) -> str:
+        with _counter_lock:
+            self.calls += 1
+            index = self.calls - 1
+        if self.echo and messages:
+            content = str(messages[-1].content)
+            match = re.search(r"Follow Up Input:\s*(.*?)\s*(?:\nStandalone question:|$)", content, re.S)
+            return match.group(1) if match else content
+        return self.responses[index % len(self.responses)]
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        return re.findall(r"\S+\s*", text) or [text]
+
+    def _record(self, seconds: float) -> None:
+        with _counter_lock:
+            self.model_seconds += seconds
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self._next_response(messages)
+        time.sleep(self.first_token_latency)
+        self._record(self.first_token_latency)
+        for token in self._tokens(text):
+            delay = 1.0 / self.tokens_per_second
+            time.sleep(delay)
+            self._record(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text = self._next_response(messages)
+        await asyncio.sleep(self.first_token_latency)
+        self._record(self.first_token_latency)
+        for token in self._tokens(text):
+            delay = 1.0 / self.tokens_per_second
+            await asyncio.sleep(delay)
+            self._record(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+        text = self._next_response(messages)
+        seconds = self.first_token_latency + len(self._tokens(text)) / self.tokens_per_second
+        time.sleep(seconds)
+        self._record(seconds)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+        text = self._next_response(messages)
+        seconds = self.first_token_latency + len(self._tokens(text)) / self.tokens_per_second
+        await asyncio.sleep(seconds)
+        self._record(seconds)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
@@ -0,0 +1,181 @@
+"""
+Per-stage latency histograms.
+
+Code marks its stages with spans, or whole functions with @timed:
+
+    with metrics.span("query_by_text.embed"):
+        ...
+
+Nothing is recorded until metrics are enabled, either with enable() or by
+setting METRICS_EXPORT_PATH; a disabled span is a shared no-op context
+manager, so instrumented code costs one function call per stage. With
+METRICS_EXPORT_PATH set, the histograms are written there when the
+process exits: as JSON if the path ends in ".json", otherwise in the
+Prometheus text format.
+"""
+import asyncio
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+EXPORT_PATH = os.getenv("METRICS_EXPORT_PATH")
+
+# Upper bounds in seconds, as in the Prometheus client defaults
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_NAME = "stage_duration_seconds"
+
+_NOOP = nullcontext()
+_enabled = bool(EXPORT_PATH)
+_lock = threading.Lock()
+
+
+class Histogram:
+    """Bucketed durations of one stage. Callers hold the module lock."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (inf if past the last bound)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+_histograms: Dict[str, Histogram] = {}
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def span(name: str):
+    """Time the enclosed block as stage 'name'."""
+    return _Span(name) if _enabled else _NOOP
+
+
+def timed(name: str):
+    """Decorator form of span() for a whole function or coroutine function."""
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await fn(*args, **kwargs)
+                with _Span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration measured elsewhere (e.g. from callbacks)."""
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def reset() -> None:
+    with _lock:
+        _histograms.clear()
+
+
+def to_json() -> dict:
+    with _lock:
+        return {
+            name: {
+                "count": h.count,
+                "sum_seconds": h.sum,
+                "mean_ms": h.sum / h.count * 1000 if h.count else 0.0,
+                "p50_ms_le": h.quantile(0.5) * 1000,
+                "p95_ms_le": h.quantile(0.95) * 1000,
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.counts)),
+            }
+            for name, h in sorted(_histograms.items())
+        }
+
+
+def to_prometheus() -> str:
+    lines = [
+        f"# HELP {METRIC_NAME} Time spent in each request and ingest stage.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    with _lock:
+        for name, h in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip([repr(b) for b in BUCKETS] + ["+Inf"], h.counts):
+                cumulative += count
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{name}"}} {h.sum}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{name}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+def export(path: Optional[str] = None) -> Optional[str]:
+    """Write the histograms to 'path' (default METRICS_EXPORT_PATH); returns the path written."""
+    path = path or EXPORT_PATH
+    if not path:
+        return None
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    content = json.dumps(to_json(), indent=2) if path.endswith(".json") else to_prometheus()
+    # written whole and renamed, so a scraper never reads half a file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return path
+
+
+if EXPORT_PATH:
+    atexit.register(export)
@@ -0,0 +1,373 @@
+"""
+Routing layer over one Chroma collection per record type.
+
+Transactions vastly outnumber offers, assets and strategies, so keeping
+them in one collection meant every catalog search walked a
+transaction-dominated HNSW graph and filtered on record_type.
+PartitionedCollection stores each record type in its own collection
+("financial_data_transaction", "financial_data_offer", ...) and exposes
+the subset of the Chroma collection API the rest of the code uses
+(upsert, delete, get, query, count), routing each call by the record_type
+in 'where', the metadata being written or the ID prefix.
+
+Catalog partitions are small, so readers keep an in-memory copy of them
+and search it exhaustively; the copy is refreshed when embedding.py bumps
+the partition's version.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+PARTITIONS = ("transaction", "offer", "financial_asset", "investment_strategy")
+ID_PREFIXES = {
+    "txn_": "transaction",
+    "off_": "offer",
+    "asset_": "financial_asset",
+    "strat_": "investment_strategy",
+}
+CATALOG_PARTITIONS = ("offer", "financial_asset", "investment_strategy")
+# catalog partitions larger than this are searched through Chroma instead
+MEMORY_PARTITION_MAX = int(os.getenv("MEMORY_PARTITION_MAX", "100000"))
+
+DEFAULT_INCLUDE = ["metadatas", "documents"]
+DEFAULT_QUERY_INCLUDE = ["metadatas", "documents", "distances"]
+
+
+def partition_of(record_id: str) -> Optional[str]:
+    for prefix, record_type in ID_PREFIXES.items():
+        if record_id.startswith(prefix):
+            return record_type
+    return None
+
+
+def where_record_types(where: Optional[Dict[str, Any]]) -> Sequence[str]:
+    """The partitions a Chroma 'where' filter can match, from its record_type condition."""
+    if not where:
+        return PARTITIONS
+    if "$and" in where:
+        for condition in where["$and"]:
+            types = where_record_types(condition)
+            if len(types) < len(PARTITIONS):
+                return types
+        return PARTITIONS
+    condition = where.get("record_type")
+    if isinstance(condition, str):
+        return (condition,) if condition in PARTITIONS else ()
+    if isinstance(condition, dict):
+        if "$eq" in condition:
+            return (condition["$eq"],) if condition["$eq"] in PARTITIONS else ()
+        if "$in" in condition:
+            return tuple(t for t in PARTITIONS if t in condition["$in"])
+    return PARTITIONS
+
+
+def matches(where: Optional[Dict[str, Any]], metadata: Dict[str, Any]) -> bool:
+    """Evaluate a Chroma 'where' filter against one metadata dict."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(clause, metadata) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(clause, metadata) for clause in condition):
+                return False
+        else:
+            value = metadata.get(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, operand in condition.items():
+                if op == "$eq" and not value == operand:
+                    return False
+                if op == "$ne" and not value != operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    if op == "$gt" and not value > operand:
+                        return False
+                    if op == "$gte" and not value >= operand:
+                        return False
+                    if op == "$lt" and not value < operand:
+                        return False
+                    if op == "$lte" and not value <= operand:
+                        return False
+    return True
+
+
+def _empty_get(include: Sequence[str]) -> Dict[str, List]:
+    result = {"ids": []}
+    for field in include:
+        result[field] = []
+    return result
+
+
+class _Snapshot:
+    """In-memory copy of one catalog partition."""
+
+    def __init__(self, stored: Dict[str, Any], version: int):
+        self.version = version
+        self.ids = list(stored["ids"])
+        self.documents = list(stored["documents"])
+        self.metadatas = list(stored["metadatas"])
+        if self.ids:
+            self.embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+        else:
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+        self.norms = np.einsum("ij,ij->i", self.embeddings, self.embeddings)
+        self.rows = {record_id: row for row, record_id in enumerate(self.ids)}
+
+
+class PartitionedCollection:
+    """
+    Drop-in stand-in for a Chroma collection that routes records to one
+    collection per record type. 'versions' (an IndexVersions) is bumped
+    on every write so other processes refresh their in-memory catalogs.
+    """
+
+    def __init__(self, client, base_name: str, versions=None):
+        self.client = client
+        self.base_name = base_name
+        self.versions = versions
+        self.partitions = {
+            record_type: client.get_or_create_collection(name=self.partition_name(record_type))
+            for record_type in PARTITIONS
+        }
+        self._snapshots: Dict[str, _Snapshot] = {}
+        self._lock = threading.Lock()
+
+    def partition_name(self, record_type: str) -> str:
+        return f"{self.base_name}_{record_type}"
+
+    # --- writes -------------------------------------------------------------
+
+    def upsert(self, ids: List[str], embeddings=None, metadatas: List[Dict[str, Any]] = None,
+               documents: List[str] = None) -> None:
+        groups: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(metadata["record_type"], []).append(i)
+        for record_type, rows in groups.items():
+            self.partitions[record_type].upsert(
+                ids=[ids[i] for i in rows],
+                embeddings=[embeddings[i] for i in rows] if embeddings is not None else None,
+                metadatas=[metadatas[i] for i in rows],
+                documents=[documents[i] for i in rows] if documents is not None else None
+            )
+        self._changed(groups)
+
+    def delete(self, ids: List[str]) -> None:
+        groups: Dict[str, List[str]] = {}
+        for record_id in ids:
+            record_type = partition_of(record_id)
+            for target in ([record_type] if record_type else PARTITIONS):
+                groups.setdefault(target, []).append(record_id)
+        for record_type, group in groups.items():
+            self.partitions[record_type].delete(ids=group)
+        self._changed(groups)
+
+    def _changed(self, record_types) -> None:
+        catalog = [record_type for record_type in record_types if record_type in CATALOG_PARTITIONS]
+        if catalog and self.versions is not None:
+            self.versions.bump_partitions(catalog)
+        with self._lock:
+            for record_type in catalog:
+                self._snapshots.pop(record_type, None)
+
+    # --- reads --------------------------------------------------------------
+
+    def count(self) -> int:
+        return sum(partition.count() for partition in self.partitions.values())
+
+    def _snapshot(self, record_type: str) -> Optional[_Snapshot]:
+        """The in-memory copy of a catalog partition, or None if it is searched in Chroma."""
+        if record_type not in CATALOG_PARTITIONS:
+            return None
+        version = self.versions.partition_version(record_type) if self.versions is not None else 0
+        with self._lock:
+            snapshot = self._snapshots.get(record_type)
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            partition = self.partitions[record_type]
+            if partition.count() > MEMORY_PARTITION_MAX:
+                return None
+            snapshot = _Snapshot(
+                partition.get(include=["embeddings", "documents", "metadatas"]), version
+            )
+            self._snapshots[record_type] = snapshot
+            return snapshot
+
+    @staticmethod
+    def _select(snapshot: _Snapshot, rows: List[int], include: Sequence[str]) -> Dict[str, List]:
+        result = {"ids": [snapshot.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [snapshot.documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [snapshot.metadatas[row] for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = snapshot.embeddings[rows] if rows else []
+        return result
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Sequence[str] = DEFAULT_INCLUDE, limit: Optional[int] = None,
+            offset: Optional[int] = None) -> Dict[str, List]:
+        include = list(include)
+        if ids is not None:
+            groups: Dict[str, List[str]] = {}
+            for record_id in ids:
+                record_type = partition_of(record_id)
+                for target in ([record_type] if record_type else PARTITIONS):
+                    groups.setdefault(target, []).append(record_id)
+            pages = []
+            for record_type, group in groups.items():
+                snapshot = self._snapshot(record_type) if where is None else None
+                if snapshot is not None:
+                    rows = [snapshot.rows[record_id] for record_id in group if record_id in snapshot.rows]
+                    pages.append(self._select(snapshot, rows, include))
+                else:
+                    pages.append(self.partitions[record_type].get(ids=group, where=where, include=include))
+            return self._merge_get(pages, include, limit, offset)
+
+        record_types = where_record_types(where)
+        if len(record_types) == 1:
+            # one partition (e.g. paging through a record type): Chroma pages it directly
+            return self.partitions[record_types[0]].get(
+                where=where, include=include, limit=limit, offset=offset
+            )
+
+        # walk the partitions in order, carrying the offset and limit across them
+        pages = []
+        skip = offset or 0
+        remaining = limit
+        for record_type in record_types:
+            if remaining is not None and remaining <= 0:
+                break
+            partition = self.partitions[record_type]
+            if skip:
+                # each partition before the offset is sized once per call, with IDs only
+                available = self._size(record_type, where)
+                if available <= skip:
+                    skip -= available
+                    continue
+            page = partition.get(where=where, include=include, limit=remaining, offset=skip or None)
+            skip = 0
+            pages.append(page)
+            if remaining is not None:
+                remaining -= len(page["ids"])
+        return self._merge_get(pages, include, None, None)
+
+    def _size(self, record_type: str, where: Optional[Dict[str, Any]]) -> int:
+        """Records of one partition that match 'where'."""
+        partition = self.partitions[record_type]
+        if not where or list(where) == ["record_type"]:
+            # every record of a partition the walk visits matches its record_type condition
+            return partition.count()
+        return len(partition.get(where=where, include=[])["ids"])
+
+    @staticmethod
+    def _merge_get(pages: List[Dict[str, Any]], include: Sequence[str], limit: Optional[int],
+                   offset: Optional[int]) -> Dict[str, List]:
+        result = _empty_get(include)
+        for page in pages:
+            result["ids"].extend(page["ids"])
+            for field in include:
+                values = page.get(field)
+                if values is not None:
+                    result[field].extend(list(values))
+        if offset or limit is not None:
+            end = None if limit is None else (offset or 0) + limit
+            for field in result:
+                result[field] = result[field][offset or 0:end]
+        return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = DEFAULT_QUERY_INCLUDE) -> Dict[str, List]:
+        """
+        Nearest neighbours (squared L2, as in Chroma) of each query
+        embedding across the partitions 'where' can match.
+        """
+        include = list(include)
+        fields = set(include) | {"distances"}
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        per_partition = []
+        for record_type in where_record_types(where):
+            snapshot = self._snapshot(record_type)
+            if snapshot is not None:
+                per_partition.append(self._query_snapshot(snapshot, queries, n_results, where, fields))
+            elif self.partitions[record_type].count() > 0:
+                per_partition.append(self.partitions[record_type].query(
+                    query_embeddings=queries.tolist(),
+                    n_results=n_results,
+                    where=where,
+                    include=sorted(fields)
+                ))
+
+        result = {"ids": []}
+        for field in include:
+            result[field] = []
+        for q in range(len(queries)):
+            candidates = []
+            for page in per_partition:
+                for i, distance in enumerate(page["distances"][q]):
+                    candidates.append((distance, page, i))
+            candidates.sort(key=lambda candidate: candidate[0])
+            best = candidates[:n_results]
+            result["ids"].append([page["ids"][q][i] for _, page, i in best])
+            for field in include:
+                result[field].append([page[field][q][i] for _, page, i in best])
+        return result
+
+    def _query_snapshot(self, snapshot: _Snapshot, queries: np.ndarray, n_results: int,
+                        where: Optional[Dict[str, Any]], fields) -> Dict[str, List]:
+        candidates = np.asarray(
+            [row for row, metadata in enumerate(snapshot.metadatas) if matches(where, metadata)],
+            dtype=np.int64
+        )
+        page = {field: [] for field in fields}
+        page["ids"] = []
+        for query in queries:
+            if len(candidates):
+                distances = snapshot.norms[candidates] + float(query @ query) - 2.0 * (snapshot.embeddings[candidates] @ query)
+                order = np.argsort(distances)[:n_results]
+                rows = candidates[order].tolist()
+                distances = distances[order].tolist()
+            else:
+                rows, distances = [], []
+            selected = self._select(snapshot, rows, fields)
+            page["ids"].append(selected["ids"])
+            page["distances"].append(distances)
+            for field in fields - {"distances"}:
+                page[field].append(selected[field])
+        return page
+
+    # --- migration ----------------------------------------------------------
+
+    def migrate_legacy(self, page_size: int = 5000) -> int:
+        """
+        Copy records from the old single collection (named 'base_name')
+        into the partitions. Returns the number of records copied; 0 if
+        there is no legacy collection.
+        """
+        if self.base_name not in [collection.name for collection in self.client.list_collections()]:
+            return 0
+        legacy = self.client.get_collection(name=self.base_name)
+        copied = 0
+        offset = 0
+        while True:
+            page = legacy.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.upsert(
+                ids=page["ids"],
+                embeddings=page["embeddings"],
+                metadatas=page["metadatas"],
+                documents=page["documents"]
+            )
+            copied += len(page["ids"])
+            offset += len(page["ids"])
+        return copied
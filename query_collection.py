@@ -1,72 +1,151 @@
-from chromadb import Client
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
 import os
 
-# Initialize the client and get the collection
-chroma_client = Client(Settings(
-    persist_directory="./chroma_db",
-    is_persistent=True  # Explicitly enable persistence
-))
+import metrics
+import resources
+from lexical_index import is_exact_query
 
-print(f"Using persistence directory: {os.path.abspath('./chroma_db')}")
+# The client, collection and embedding model are created on first use (see
+# resources.py), so importing this module is cheap and they are shared with
+# the rest of the process.
 
-try:
-    collection = chroma_client.get_collection(name="financial_data")
-    print(f"Successfully retrieved collection: financial_data")
-    print(f"Collection count: {collection.count()}")
-except Exception as e:
-    print(f"Error accessing collection: {str(e)}")
-    raise
+# Reciprocal rank fusion constant; 60 is the usual choice
+RRF_K = 60
 
-# Initialize the same embedding model used for creating embeddings
-model = SentenceTransformer("all-MiniLM-L6-v2")
+@metrics.timed("query_by_text")
+def query_by_text(query_text, n_results=5, encode=None, compact=False, hybrid=None):
+    """
+    Query the collection using text and return similar items. 'encode'
+    replaces the model's encode for cache misses (the service passes its
+    micro-batching encoder here). With compact=True the nearest neighbours
+    come from the quantized compact index instead of Chroma's HNSW index.
 
-def query_by_text(query_text, n_results=5):
-    """Query the collection using text and return similar items"""
-    # Convert query text to embedding
-    query_embedding = model.encode(query_text).tolist()
+    With hybrid=True (the default once embedding.py has built the BM25
+    index) dense and BM25 results are merged with reciprocal rank fusion;
+    exact-term queries (quoted, or a bare ID) skip the embedding model
+    and use BM25 alone. Hybrid results carry "scores" (higher is
+    better) instead of "distances".
+    """
+    if hybrid is None:
+        hybrid = resources.has_lexical_index()
+    if hybrid and is_exact_query(query_text):
+        return query_lexical_index(query_text.strip().strip("\"'"), n_results)
     
-    # Search the collection
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results
-    )
+    # Convert query text to embedding (repeated queries are served from the cache)
+    with metrics.span("query_by_text.embed"):
+        cache = resources.get_embedding_cache()
+        # the model is only loaded when the text misses the cache
+        encode = encode or (lambda texts: resources.get_model().encode(texts))
+        query_embedding = cache.get_or_compute([query_text], encode)[0].tolist()
+    
+    # fetch a deeper candidate list from each side when the lists are fused
+    depth = max(4 * n_results, 20) if hybrid else n_results
+    if compact:
+        results = query_compact_index(query_embedding, depth)
+    else:
+        # Search the collection
+        with metrics.span("query_by_text.vector_search"):
+            results = resources.get_collection().query(
+                query_embeddings=[query_embedding],
+                n_results=depth
+            )
+    if not hybrid:
+        return results
     
-    return results
+    with metrics.span("query_by_text.lexical_search"):
+        lexical = resources.get_lexical_index().search(query_text, depth)
+    fused = {}
+    for ranking in (results["ids"][0], [record_id for record_id, _ in lexical]):
+        for rank, record_id in enumerate(ranking):
+            fused[record_id] = fused.get(record_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:n_results]
+    return _hydrate(best, "scores")
+
+def query_lexical_index(query_text, n_results=5):
+    """BM25-only search; no embedding is computed. Results carry BM25 "scores"."""
+    with metrics.span("query_by_text.lexical_search"):
+        hits = resources.get_lexical_index().search(query_text, n_results)
+    return _hydrate(hits, "scores")
+
+def query_compact_index(query_embedding, n_results=5, record_type=None):
+    """
+    Search the compact index, then fetch documents and metadata for the
+    hits from Chroma. Returns the same shape as collection.query().
+    """
+    with metrics.span("query_by_text.compact_search"):
+        hits = resources.get_compact_index().search(query_embedding, n_results, record_type=record_type)
+    return _hydrate(hits, "distances")
 
+@metrics.timed("query_by_text.hydrate")
+def _hydrate(hits, score_key):
+    """
+    Turn ranked (record id, score) pairs into the nested shape of
+    collection.query(), fetching documents and metadata from Chroma.
+    """
+    ids = [record_id for record_id, _ in hits]
+    records = resources.get_collection().get(ids=ids, include=["documents", "metadatas"]) if ids else {
+        "ids": [], "documents": [], "metadatas": []
+    }
+    by_id = {
+        record_id: (document, metadata)
+        for record_id, document, metadata in zip(records["ids"], records["documents"], records["metadatas"])
+    }
+    # skip anything a side index still has but Chroma no longer does
+    hits = [(record_id, score) for record_id, score in hits if record_id in by_id]
+    ids = [record_id for record_id, _ in hits]
+    return {
+        "ids": [ids],
+        "documents": [[by_id[record_id][0] for record_id in ids]],
+        "metadatas": [[by_id[record_id][1] for record_id in ids]],
+        score_key: [[score for _, score in hits]],
+    }
+
+@metrics.timed("query_by_metadata")
 def query_by_metadata(metadata_filter, n_results=5):
-    """Query the collection using metadata filters"""
-    results = collection.query(
+    """
+    Query the collection using metadata filters. The filter's record_type
+    picks the partition, so no embedding is involved; results have the
+    same nested shape as query_by_text.
+    """
+    results = resources.get_collection().get(
         where=metadata_filter,
-        n_results=n_results
+        limit=n_results
     )
-    return results
+    return {key: [values] for key, values in results.items()}
+
+if __name__ == "__main__":
+    print(f"Using persistence directory: {os.path.abspath(resources.PERSIST_DIRECTORY)}")
+    try:
+        collection = resources.get_collection()
+        print(f"Successfully retrieved collection: {resources.COLLECTION_NAME}")
+        print(f"Collection count: {collection.count()}")
+    except Exception as e:
+        print(f"Error accessing collection: {str(e)}")
+        raise
 
-# Example 1: Search for similar transactions
-print("\n=== Searching for transactions similar to 'groceries' ===")
-results = query_by_text("groceries")
-for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
-    print(f"\nResult {i+1}:")
-    print(f"Document: {doc}")
-    print(f"Metadata: {metadata}")
+    # Example 1: Search for similar transactions
+    print("\n=== Searching for transactions similar to 'groceries' ===")
+    results = query_by_text("groceries")
+    for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
+        print(f"\nResult {i+1}:")
+        print(f"Document: {doc}")
+        print(f"Metadata: {metadata}")
 
-# Example 2: Search by metadata
-print("\n=== Searching for high-risk financial assets ===")
-results = query_by_metadata(
-    {"record_type": "financial_asset", "risk_rating": "high"}
-)
-for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
-    print(f"\nResult {i+1}:")
-    print(f"Document: {doc}")
-    print(f"Metadata: {metadata}")
+    # Example 2: Search by metadata
+    print("\n=== Searching for high-risk financial assets ===")
+    results = query_by_metadata(
+        {"record_type": "financial_asset", "risk_rating": "high"}
+    )
+    for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
+        print(f"\nResult {i+1}:")
+        print(f"Document: {doc}")
+        print(f"Metadata: {metadata}")
 
-# Example 3: Get all records of a specific type
-print("\n=== Getting all offers ===")
-results = query_by_metadata(
-    {"record_type": "offer"}
-)
-for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
-    print(f"\nResult {i+1}:")
-    print(f"Document: {doc}")
-    print(f"Metadata: {metadata}") 
\ No newline at end of file
+    # Example 3: Get all records of a specific type
+    print("\n=== Getting all offers ===")
+    results = query_by_metadata(
+        {"record_type": "offer"}
+    )
+    for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
+        print(f"\nResult {i+1}:")
+        print(f"Document: {doc}")
+        print(f"Metadata: {metadata}") 
\ No newline at end of file
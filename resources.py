@@ -0,0 +1,171 @@
+"""
+Process-wide, lazily created shared resources.
+
+Importing this module (or any module that uses it) does not import torch,
+sentence-transformers or chromadb. Each resource is built on first use and
+then shared by embedding.py, query_collection.py and TransactionAssistant
+within the same process.
+"""
+import os
+import threading
+
+PERSIST_DIRECTORY = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+COLLECTION_NAME = os.getenv("CHROMA_COLLECTION", "financial_data")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+# Sidecar stores and indexes are derived from the Chroma collection, so by
+# default they live next to it
+USER_STORE_PATH = os.getenv("USER_STORE_PATH", os.path.join(PERSIST_DIRECTORY, "user_store.sqlite3"))
+COMPACT_INDEX_DIR = os.getenv("COMPACT_INDEX_DIR", os.path.join(PERSIST_DIRECTORY, "compact_index"))
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(PERSIST_DIRECTORY, "lexical_index.sqlite3"))
+CATALOG_STORE_DIR = os.getenv("CATALOG_STORE_DIR", os.path.join(PERSIST_DIRECTORY, "catalog_store"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(PERSIST_DIRECTORY, "embedding_cache"))
+# Output sizes of common Sentence-Transformers models, so the stores sized by
+# them can be opened without loading the model (EMBEDDING_DIM overrides)
+MODEL_DIMENSIONS = {
+    "all-MiniLM-L6-v2": 384,
+    "all-MiniLM-L12-v2": 384,
+    "paraphrase-MiniLM-L6-v2": 384,
+    "multi-qa-MiniLM-L6-cos-v1": 384,
+    "all-mpnet-base-v2": 768,
+    "multi-qa-mpnet-base-dot-v1": 768,
+}
+
+_lock = threading.RLock()
+_instances = {}
+
+
+def _shared(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def is_loaded(name: str) -> bool:
+    """Whether a resource (e.g. "model") has been created in this process."""
+    return name in _instances
+
+
+def get_model():
+    """The SentenceTransformer used for every embedding in this process."""
+    def load():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _shared("model", load)
+
+
+def embedding_dim() -> int:
+    """Size of EMBEDDING_MODEL_NAME's vectors; loads the model only if it is not a known one."""
+    configured = os.getenv("EMBEDDING_DIM")
+    if configured:
+        return int(configured)
+    known = MODEL_DIMENSIONS.get(EMBEDDING_MODEL_NAME.rsplit("/", 1)[-1])
+    if known:
+        return known
+    return get_model().get_sentence_embedding_dimension()
+
+
+def get_chroma_client():
+    def connect():
+        from chromadb import Client
+        from chromadb.config import Settings
+        return Client(Settings(
+            persist_directory=PERSIST_DIRECTORY,
+            is_persistent=True  # Explicitly enable persistence
+        ))
+    return _shared("chroma_client", connect)
+
+
+def get_collection(create: bool = False):
+    """
+    The financial_data records as a PartitionedCollection (one Chroma
+    collection per record type). A store written before partitioning is
+    copied into the partitions the first time it is opened. Without
+    create=True a missing store is an error.
+    """
+    def open_collection():
+        from partitions import PARTITIONS, PartitionedCollection
+        client = get_chroma_client()
+        existing = {collection.name for collection in client.list_collections()}
+        names = {COLLECTION_NAME} | {f"{COLLECTION_NAME}_{record_type}" for record_type in PARTITIONS}
+        if not create and not existing & names:
+            raise ValueError(f"Collection {COLLECTION_NAME} does not exist.")
+        collection = PartitionedCollection(client, COLLECTION_NAME, get_versions())
+        if collection.count() == 0:
+            copied = collection.migrate_legacy()
+            if copied:
+                print(f"Copied {copied} records from collection '{COLLECTION_NAME}' into per-type partitions")
+        return collection
+    return _shared("collection", open_collection)
+
+
+def get_embedding_cache():
+    def open_cache():
+        from embedding_cache import EmbeddingCache
+        return EmbeddingCache(EMBEDDING_MODEL_NAME, EMBEDDING_CACHE_DIR, dim=embedding_dim())
+    return _shared("embedding_cache", open_cache)
+
+
+def get_user_index():
+    def open_index():
+        from user_store import UserIndex
+        return UserIndex(USER_STORE_PATH)
+    return _shared("user_index", open_index)
+
+
+def get_profiles():
+    def open_profiles():
+        from user_store import ProfileStore
+        return ProfileStore(USER_STORE_PATH)
+    return _shared("profiles", open_profiles)
+
+
+def get_versions():
+    def open_versions():
+        from user_store import IndexVersions
+        return IndexVersions(USER_STORE_PATH)
+    return _shared("versions", open_versions)
+
+
+def get_offer_eligibility():
+    def open_eligibility():
+        from user_store import OfferEligibility
+        return OfferEligibility(USER_STORE_PATH)
+    return _shared("offer_eligibility", open_eligibility)
+
+
+def get_catalog_store():
+    """Typed, memory-mapped offer, strategy and asset columns (see catalog_store.py)."""
+    def open_store():
+        from catalog_store import CatalogStore
+        return CatalogStore(CATALOG_STORE_DIR)
+    return _shared("catalog_store", open_store)
+
+
+def has_compact_index() -> bool:
+    """Whether embedding.py has built a compact index (--compact-index)."""
+    return os.path.exists(os.path.join(COMPACT_INDEX_DIR, "rows.sqlite3"))
+
+
+def get_compact_index(dtype: str = "int8"):
+    """The quantized CompactIndex; 'dtype' only matters when it is first created."""
+    def open_index():
+        from compact_index import CompactIndex
+        return CompactIndex(COMPACT_INDEX_DIR, dtype=dtype, dim=embedding_dim())
+    return _shared("compact_index", open_index)
+
+
+def has_lexical_index() -> bool:
+    """Whether embedding.py has built the BM25 index (--lexical-index)."""
+    return os.path.exists(LEXICAL_INDEX_PATH)
+
+
+def get_lexical_index():
+    def open_index():
+        from lexical_index import BM25Index
+        return BM25Index(LEXICAL_INDEX_PATH)
+    return _shared("lexical_index", open_index)
@@ -0,0 +1,281 @@
+"""
+Long-running HTTP service for retrieval, recommendations and chat.
+
+The embedding model, Chroma client and TransactionAssistant are loaded
+once at startup and stay warm. Query texts that miss the embedding cache
+are handed to a MicroBatchEncoder, which collects texts from concurrent
+requests for a few milliseconds and encodes them in one forward pass.
+Chat keeps one conversation per session_id; a request without one starts
+a new session, whose id is returned (in the X-Session-Id header when
+streaming).
+
+    python service.py --port 8000
+
+    POST /query            {"text": "groceries", "n_results": 5}
+    POST /recommendations  {"user_id": "...", "since": null, "until": null, "risk_profile": null}
+    POST /chat             {"question": "...", "session_id": null, "stream": false}
+    GET  /health
+    GET  /metrics          per-stage latency histograms, Prometheus text (with --metrics)
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+import metrics
+import resources
+import query_collection
+
+BATCH_WINDOW_MS = float(os.getenv("SERVICE_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.getenv("SERVICE_MAX_BATCH_SIZE", "64"))
+
+
+class MicroBatchEncoder:
+    """
+    Drop-in replacement for model.encode that coalesces calls from many
+    threads. The first pending call opens a window of 'window_ms'; every
+    text queued before it closes (up to 'max_batch_size') is encoded in a
+    single model.encode call on a background thread.
+    """
+
+    def __init__(self, model, window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = MAX_BATCH_SIZE):
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.texts = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batch-encoder", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._collect()
+            # identical texts in the same window are encoded once
+            unique = list(dict.fromkeys(text for texts, _ in requests for text in texts))
+            try:
+                vectors = np.asarray(
+                    self.model.encode(unique, batch_size=max(1, len(unique))), dtype=np.float32
+                )
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(unique)
+            rows = {text: i for i, text in enumerate(unique)}
+            for texts, future in requests:
+                future.set_result(vectors[[rows[text] for text in texts]])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
+
+
+class RecommendationService:
+    """The warm resources behind the HTTP handler."""
+
+    def __init__(self, llm_backend: Optional[str] = None, window_ms: float = BATCH_WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        self.encoder = MicroBatchEncoder(resources.get_model(), window_ms, max_batch_size)
+        resources.get_collection()
+        self.assistant = None
+        self.assistant_error = None
+        try:
+            from financial_assistant import TransactionAssistant
+            self.assistant = TransactionAssistant(llm_backend=llm_backend, encode=self.encoder.encode)
+        except ValueError as e:
+            # retrieval still works without LLM credentials
+            self.assistant_error = str(e)
+
+    def query(self, text: str, n_results: int = 5) -> dict:
+        return query_collection.query_by_text(text, n_results, encode=self.encoder.encode)
+
+    def recommendations(self, user_id: str, since: Optional[str] = None, until: Optional[str] = None,
+                        risk_profile: Optional[str] = None) -> dict:
+        return self._require_assistant().get_transaction_recommendations(user_id, since, until, risk_profile)
+
+    def chat(self, question: str, session_id: str) -> str:
+        return self._require_assistant().chat(question, session_id)
+
+    def stream_chat(self, question: str, session_id: str):
+        assistant = self._require_assistant()  # fail before any response is sent
+        return assistant.stream_chat(question, session_id)
+
+    def health(self) -> dict:
+        return {
+            "collection_count": resources.get_collection().count(),
+            "assistant": self.assistant_error or "ready",
+            "chat_sessions": self.assistant.memory.stats() if self.assistant else None,
+            "context_compression": self.assistant.context_compressor.stats() if self.assistant else None,
+            "answer_cache": self.assistant.answer_cache.stats() if self.assistant else None,
+            "encoder": self.encoder.stats(),
+            "embedding_cache": resources.get_embedding_cache().stats(),
+        }
+
+    def _require_assistant(self):
+        if self.assistant is None:
+            raise LookupError(f"Assistant unavailable: {self.assistant_error}")
+        return self.assistant
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service: RecommendationService = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # one line per request is too noisy under load
+
+    def _send_json(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    def _send_stream(self, chunks, session_id: str) -> None:
+        chunks = iter(chunks)
+        # errors before the first chunk still get a proper JSON error response from do_POST
+        first = next(chunks, "")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("X-Session-Id", session_id)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            self._write_chunk(first)
+            for chunk in chunks:
+                self._write_chunk(chunk)
+        except Exception as e:
+            # the 200 headers are already out, so the error can only go in the body.
+            # The terminating chunk is never sent and the connection is closed, so
+            # clients see a truncated response rather than a complete answer
+            self.close_connection = True
+            try:
+                self._write_chunk(f"\n[error: {e}]")
+            except OSError:
+                pass  # the client went away
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _send_text(self, status: int, text: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.service.health())
+        elif self.path == "/metrics" and metrics.enabled():
+            self._send_text(200, metrics.to_prometheus())
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("expected a JSON object")
+            if self.path == "/query":
+                result = self.service.query(body["text"], int(body.get("n_results", 5)))
+            elif self.path == "/recommendations":
+                result = self.service.recommendations(
+                    body["user_id"], body.get("since"), body.get("until"), body.get("risk_profile")
+                )
+            elif self.path == "/chat":
+                session_id = body.get("session_id") or uuid.uuid4().hex
+                if body.get("stream"):
+                    self._send_stream(self.service.stream_chat(body["question"], session_id), session_id)
+                    return
+                result = {"answer": self.service.chat(body["question"], session_id), "session_id": session_id}
+            else:
+                self._send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+        except (KeyError, ValueError) as e:
+            self._send_json(400, {"error": f"Bad request: {e}"})
+        except LookupError as e:
+            self._send_json(503, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+        else:
+            self._send_json(200, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve queries, recommendations and chat from one warm process.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS,
+                        help="how long to wait for more query texts before encoding a batch")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE,
+                        help="most texts encoded in one forward pass")
+    parser.add_argument("--llm-backend", choices=["azure", "fake"], default=None,
+                        help="LLM used for chat (default: LLM_BACKEND)")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record per-stage latencies and serve them on /metrics")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+
+    start = time.perf_counter()
+    ServiceHandler.service = RecommendationService(args.llm_backend, args.batch_window_ms, args.max_batch_size)
+    print(f"Loaded model and collection in {time.perf_counter() - start:.1f}s")
+    if ServiceHandler.service.assistant_error:
+        print(f"Chat and recommendations disabled: {ServiceHandler.service.assistant_error}")
+
+    server = ThreadingHTTPServer((args.host, args.port), ServiceHandler)
+    server.daemon_threads = True
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
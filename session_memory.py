@@ -0,0 +1,155 @@
+import asyncio
+import os
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from result_cache import TTLCache
+
+# Tokens of chat history sent with every turn: running summary plus recent turns
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKENS", "1000"))
+# Part of that budget the running summary may take up
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKENS", "250"))
+MAX_SESSIONS = int(os.getenv("CHAT_MAX_SESSIONS", "10000"))
+# Sessions with no turn for this long are dropped
+SESSION_IDLE_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_SECONDS", "1800"))
+
+DEFAULT_SESSION = "default"
+
+# Good enough for English text with OpenAI tokenizers, and free to compute
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Progressively summarize the conversation between a user and a financial assistant, \
+adding onto the previous summary and returning a new summary. Keep any user IDs, amounts, dates and \
+categories that were mentioned. Be brief.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+Turn = Tuple[str, str]
+
+
+def count_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Keep the last 'budget' tokens of 'text', which is where new information goes."""
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[-limit:].split(" ", 1)[-1]
+
+
+def format_turns(turns: List[Turn]) -> str:
+    return "\n".join(f"Human: {question}\nAssistant: {answer}" for question, answer in turns)
+
+
+class ConversationSession:
+    """
+    One conversation: a running summary plus the latest turns, verbatim.
+    Both are replaced together as one tuple, so readers never need the
+    lock that 'record' holds while summarizing.
+    """
+
+    def __init__(self):
+        self.state: Tuple[str, Tuple[Turn, ...]] = ("", ())
+        self.lock = threading.Lock()
+
+
+class SessionMemory:
+    """
+    Chat history per session, kept within a token budget.
+
+    Recent turns are sent verbatim. Once they no longer fit next to the
+    summary, the oldest ones are folded into the running summary with one
+    'summarize(summary, turns)' call, freeing half the room at a time. Each
+    turn then sends (and condenses) at most 'history_tokens' of history
+    however long the conversation gets.
+    Sessions live in a bounded in-process store and are dropped after
+    'idle_seconds' without a turn.
+    """
+
+    def __init__(self, summarize: Callable[[str, List[Turn]], str],
+                 history_tokens: int = HISTORY_TOKEN_BUDGET, summary_tokens: int = SUMMARY_TOKEN_BUDGET,
+                 max_sessions: int = MAX_SESSIONS, idle_seconds: float = SESSION_IDLE_SECONDS):
+        if summary_tokens >= history_tokens:
+            raise ValueError("CHAT_SUMMARY_TOKENS must be smaller than CHAT_HISTORY_TOKENS")
+        self.summarize = summarize
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=idle_seconds)
+        self._lock = threading.Lock()
+        self.summaries = 0
+
+    def _session(self, session_id: str, create: bool = False) -> Optional[ConversationSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None and create:
+                session = ConversationSession()
+                self._sessions.set(session_id, session)
+            return session
+
+    def history(self, session_id: str = DEFAULT_SESSION) -> List[BaseMessage]:
+        """The messages to send as 'chat_history' with the next turn."""
+        session = self._session(session_id)
+        if session is None:
+            return []
+        summary, turns = session.state
+        messages: List[BaseMessage] = []
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        for question, answer in turns:
+            messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        return messages
+
+    def tokens(self, session_id: str = DEFAULT_SESSION) -> int:
+        """Size of the history the next turn of this session will send."""
+        session = self._session(session_id)
+        if session is None:
+            return 0
+        summary, turns = session.state
+        return count_tokens(summary) + sum(count_tokens(q) + count_tokens(a) for q, a in turns)
+
+    def record(self, session_id: str, question: str, answer: str) -> None:
+        """Add a finished turn, folding the oldest turns into the summary if over budget."""
+        session = self._session(session_id, create=True)
+        # one record at a time per session, so concurrent turns cannot drop each other's updates
+        with session.lock:
+            summary, turns = session.state
+            turns = list(turns) + [(question, answer)]
+            sizes = [count_tokens(q) + count_tokens(a) for q, a in turns]
+            window = self.history_tokens - self.summary_tokens
+            folded = 0
+            if sum(sizes) > window:
+                # fold down to half the window, so summarizing happens every few turns, not every turn
+                while folded < len(turns) and sum(sizes[folded:]) > window // 2:
+                    folded += 1
+            if folded:
+                summary = truncate_tokens(self.summarize(summary, turns[:folded]).strip(), self.summary_tokens)
+                self.summaries += 1
+            session.state = (summary, tuple(turns[folded:]))
+        # writing the session back restarts its idle timer
+        with self._lock:
+            self._sessions.set(session_id, session)
+
+    async def arecord(self, session_id: str, question: str, answer: str) -> None:
+        await asyncio.to_thread(self.record, session_id, question, answer)
+
+    def clear(self, session_id: Optional[str] = None) -> None:
+        """Forget one session, or all of them."""
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.invalidate(session_id)
+
+    def stats(self) -> dict:
+        stats = self._sessions.stats()
+        return {"sessions": stats["size"], "evictions": stats["evictions"], "summaries": self.summaries}
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import EmbeddingCache
+
+
+def vectors(texts):
+    return np.asarray([[len(text), ord(text[0]), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_refreshed_entries_are_not_evicted_for_new_ones(tmp_path):
+    cache = EmbeddingCache("model", str(tmp_path), capacity=3, dim=3)
+    for text in ("a", "b", "c"):
+        cache.store([text], vectors([text]))
+
+    # "a" is the least recently used entry, but it is refreshed by the same call
+    cache.store(["a", "d"], vectors(["a", "d"]))
+
+    result, misses = cache.lookup(["a", "b", "c", "d"])
+    assert misses == [1]  # "b" was evicted for "d"
+    np.testing.assert_array_equal(result[[0, 2, 3]], vectors(["a", "c", "d"]))
+    assert cache.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 3
+
+
+def test_lookup_misses_when_slot_was_reused_by_another_writer(tmp_path):
+    cache = EmbeddingCache("model", str(tmp_path), capacity=2, dim=3)
+    cache.store(["a"], vectors(["a"]))
+    slot = cache.db.execute("SELECT slot FROM entries").fetchone()[0]
+
+    # what a lookup sees while another process rewrites the slot for a different key
+    cache.tags[slot] = 0
+    _, misses = cache.lookup(["a"])
+    assert misses == [0]
+
+    cache.tags[slot] = cache._tag(cache.key("b"))
+    _, misses = cache.lookup(["a"])
+    assert misses == [0]
+
+
+def test_hits_update_last_used_in_batches(tmp_path, monkeypatch):
+    import embedding_cache
+    monkeypatch.setattr(embedding_cache, "TOUCH_BATCH", 2)
+    cache = EmbeddingCache("model", str(tmp_path), capacity=3, dim=3)
+    cache.store(["a"], vectors(["a"]))
+    stored = cache.db.execute("SELECT last_used FROM entries").fetchone()[0]
+
+    cache.lookup(["a"])
+    assert cache.db.execute("SELECT last_used FROM entries").fetchone()[0] == stored
+    cache.store(["b"], vectors(["b"]))
+    cache.lookup(["a", "b"])
+    assert not cache._touched
+    assert cache.db.execute("SELECT last_used FROM entries WHERE key = ?", (cache.key("a"),)).fetchone()[0] > stored
@@ -0,0 +1,31 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding import SECTIONS, iter_json_sections
+
+DATA = {
+    "meta": 123456789,
+    "flag": True,
+    "transactions": [
+        {"record_id": "txn_1", "amount": 1234.5678, "items": [1, 22, 333]},
+        {"record_id": "txn_2", "amount": -0.25, "note": None},
+    ],
+    "version": 1.0e10,
+    "rate": -2.5e-07,
+    "offers": [{"record_id": "off_1", "discount": 15, "active": False}],
+    "tail": 987654321,
+}
+
+
+def test_iter_json_sections_matches_json_load(tmp_path):
+    path = tmp_path / "data.json"
+    path.write_text(json.dumps(DATA), encoding="utf-8")
+    with open(path, encoding="utf-8") as f:
+        loaded = json.load(f)
+    expected = [(section, record) for section, records in loaded.items() if section in SECTIONS
+                for record in records]
+    for read_size in (1, 2, 3, 5, 7, 64, 1 << 16):
+        assert list(iter_json_sections(str(path), read_size)) == expected, read_size
@@ -0,0 +1,568 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import resources
+
+DEFAULT_STORE_PATH = resources.USER_STORE_PATH
+
+TRANSACTION_COLUMNS = ("record_id", "user_id", "timestamp", "amount", "currency",
+                       "category", "merchant_name", "is_recurring")
+
+
+class UserIndex:
+    """
+    Exact user_id -> transactions lookup kept in SQLite, indexed on
+    (user_id, timestamp). It mirrors the transaction metadata stored in
+    Chroma, so a user's history can be read without any embedding call.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS transactions ("
+            "record_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, timestamp TEXT, amount REAL, "
+            "currency TEXT, category TEXT, merchant_name TEXT, is_recurring INTEGER)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS transactions_user_time ON transactions (user_id, timestamp)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _row(record_id: str, metadata: Dict[str, Any]) -> Tuple:
+        return (
+            record_id,
+            metadata.get("user_id", ""),
+            metadata.get("timestamp", ""),
+            metadata.get("amount", 0.0),
+            metadata.get("currency", ""),
+            metadata.get("category", ""),
+            metadata.get("merchant_name", ""),
+            int(bool(metadata.get("is_recurring", False))),
+        )
+
+    def upsert(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Insert or replace (record id, metadata) pairs; non-transactions are ignored."""
+        rows = [
+            self._row(record_id, metadata)
+            for record_id, metadata in records
+            if metadata.get("record_type") == "transaction"
+        ]
+        if rows:
+            with self._lock:
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO transactions ({', '.join(TRANSACTION_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(TRANSACTION_COLUMNS))})",
+                    rows
+                )
+                self.db.commit()
+        return len(rows)
+
+    def delete(self, record_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.db.executemany("DELETE FROM transactions WHERE record_id = ?", [(rid,) for rid in record_ids])
+            self.db.commit()
+
+    def transactions(self, user_id: str, since: Optional[str] = None, until: Optional[str] = None,
+                     limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Return the user's transactions, newest first. 'since' and 'until'
+        are ISO-8601 timestamps bounding the window (inclusive).
+        """
+        query = f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until:
+            query += " AND timestamp <= ?"
+            params.append(until)
+        query += " ORDER BY timestamp DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [dict(zip(TRANSACTION_COLUMNS, row)) for row in rows]
+
+    def spending(self, user_id: str, since: Optional[str] = None,
+                 until: Optional[str] = None) -> Tuple[float, float]:
+        """Return (total spend, largest single transaction) in the window."""
+        query = "SELECT COALESCE(SUM(amount), 0), COALESCE(MAX(amount), 0) FROM transactions WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until:
+            query += " AND timestamp <= ?"
+            params.append(until)
+        with self._lock:
+            total, largest = self.db.execute(query, params).fetchone()
+        return total, largest
+
+    def spending_many(self, user_ids: Sequence[str]) -> Dict[str, Tuple[float, float]]:
+        """spending() over all time for many users at once; users without transactions get (0, 0)."""
+        user_ids = list(user_ids)
+        spending = dict.fromkeys(user_ids, (0.0, 0.0))
+        with self._lock:
+            for i in range(0, len(user_ids), 500):
+                batch = user_ids[i:i + 500]
+                for user_id, total, largest in self.db.execute(
+                    "SELECT user_id, SUM(amount), MAX(amount) FROM transactions "
+                    f"WHERE user_id IN ({', '.join('?' * len(batch))}) GROUP BY user_id",
+                    batch
+                ):
+                    spending[user_id] = (total or 0.0, largest or 0.0)
+        return spending
+
+    def owners(self, record_ids: Sequence[str]) -> Dict[str, str]:
+        """Return {record id: user_id} for the given IDs that are already indexed."""
+        owners = {}
+        record_ids = list(record_ids)
+        with self._lock:
+            for i in range(0, len(record_ids), 500):
+                batch = record_ids[i:i + 500]
+                owners.update(self.db.execute(
+                    "SELECT record_id, user_id FROM transactions "
+                    f"WHERE record_id IN ({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall())
+        return owners
+
+    def count(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+
+    def rebuild(self, collection, page_size: int = 5000) -> int:
+        """
+        Re-create the index from the transaction metadata in a Chroma
+        collection (or a LangChain Chroma vector store). Returns the
+        number of transactions indexed.
+        """
+        with self._lock:
+            self.db.execute("DELETE FROM transactions")
+            self.db.commit()
+        total = 0
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"record_type": "transaction"},
+                include=["metadatas"],
+                limit=page_size,
+                offset=offset
+            )
+            if not page["ids"]:
+                break
+            total += self.upsert(zip(page["ids"], page["metadatas"]))
+            offset += len(page["ids"])
+        return total
+
+
+class ProfileStore:
+    """
+    Compact per-user spending profiles, one row per user: category spend
+    totals and counts, merchant frequencies, recurring transactions and the
+    running sum of transaction embeddings (so the centroid is sum / count).
+    Profiles are updated incrementally at ingest time, so serving a
+    recommendation only needs to read a single row.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "user_id TEXT PRIMARY KEY, transaction_count INTEGER, total_spend REAL, "
+            "category_spend TEXT, category_counts TEXT, merchant_counts TEXT, "
+            "recurring_count INTEGER, recurring_merchants TEXT, centroid_sum BLOB, updated_at REAL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _empty(user_id: str) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "transaction_count": 0,
+            "total_spend": 0.0,
+            "category_spend": {},
+            "category_counts": {},
+            "merchant_counts": {},
+            "recurring_count": 0,
+            "recurring_merchants": {},
+            "centroid_sum": None,
+        }
+
+    def _load(self, user_ids: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        profiles = {}
+        user_ids = list(user_ids)
+        for i in range(0, len(user_ids), 500):
+            batch = user_ids[i:i + 500]
+            rows = self.db.execute(
+                "SELECT user_id, transaction_count, total_spend, category_spend, category_counts, "
+                "merchant_counts, recurring_count, recurring_merchants, centroid_sum "
+                f"FROM profiles WHERE user_id IN ({', '.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for row in rows:
+                profile = {
+                    "user_id": row[0],
+                    "transaction_count": row[1],
+                    "total_spend": row[2],
+                    "category_spend": json.loads(row[3]),
+                    "category_counts": json.loads(row[4]),
+                    "merchant_counts": json.loads(row[5]),
+                    "recurring_count": row[6],
+                    "recurring_merchants": json.loads(row[7]),
+                    "centroid_sum": np.frombuffer(row[8], dtype=np.float32).copy() if row[8] else None,
+                }
+                profiles[profile["user_id"]] = profile
+        return profiles
+
+    def add_transactions(self, transactions: Iterable[Tuple[Dict[str, Any], Any]]) -> None:
+        """
+        Fold (transaction metadata, embedding) pairs into their users'
+        profiles. Only call this for transactions not already counted;
+        changed or deleted transactions go through rebuild_users().
+        """
+        by_user = defaultdict(list)
+        for metadata, embedding in transactions:
+            by_user[metadata.get("user_id", "")].append((metadata, embedding))
+        if not by_user:
+            return
+
+        with self._lock:
+            profiles = self._load(by_user)
+            rows = []
+            for user_id, items in by_user.items():
+                profile = profiles.get(user_id) or self._empty(user_id)
+                for metadata, embedding in items:
+                    amount = float(metadata.get("amount") or 0.0)
+                    category = metadata.get("category", "")
+                    merchant = metadata.get("merchant_name", "")
+                    profile["transaction_count"] += 1
+                    profile["total_spend"] += amount
+                    profile["category_spend"][category] = profile["category_spend"].get(category, 0.0) + amount
+                    profile["category_counts"][category] = profile["category_counts"].get(category, 0) + 1
+                    profile["merchant_counts"][merchant] = profile["merchant_counts"].get(merchant, 0) + 1
+                    if metadata.get("is_recurring"):
+                        profile["recurring_count"] += 1
+                        profile["recurring_merchants"][merchant] = profile["recurring_merchants"].get(merchant, 0) + 1
+                    if embedding is not None:
+                        vector = np.asarray(embedding, dtype=np.float32)
+                        if profile["centroid_sum"] is None:
+                            profile["centroid_sum"] = vector.copy()
+                        else:
+                            profile["centroid_sum"] += vector
+                rows.append((
+                    user_id,
+                    profile["transaction_count"],
+                    profile["total_spend"],
+                    json.dumps(profile["category_spend"]),
+                    json.dumps(profile["category_counts"]),
+                    json.dumps(profile["merchant_counts"]),
+                    profile["recurring_count"],
+                    json.dumps(profile["recurring_merchants"]),
+                    profile["centroid_sum"].tobytes() if profile["centroid_sum"] is not None else None,
+                    time.time(),
+                ))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO profiles (user_id, transaction_count, total_spend, category_spend, "
+                "category_counts, merchant_counts, recurring_count, recurring_merchants, centroid_sum, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.db.commit()
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the user's profile with a 'centroid' (mean embedding) and
+        'top_categories' (by spend), or None if the user has no transactions.
+        """
+        with self._lock:
+            profile = self._load([user_id]).get(user_id)
+        if profile is None or profile["transaction_count"] == 0:
+            return None
+        centroid_sum = profile.pop("centroid_sum")
+        profile["centroid"] = centroid_sum / profile["transaction_count"] if centroid_sum is not None else None
+        profile["top_categories"] = sorted(
+            (category for category in profile["category_spend"] if category),
+            key=profile["category_spend"].get,
+            reverse=True
+        )
+        return profile
+
+    def centroids(self, user_ids: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Return the users (of 'user_ids') that have a profile, and a matrix
+        with their centroid embeddings, one row each and in the same order.
+        """
+        found, rows = [], []
+        user_ids = list(user_ids)
+        with self._lock:
+            for i in range(0, len(user_ids), 500):
+                batch = user_ids[i:i + 500]
+                for user_id, count, centroid_sum in self.db.execute(
+                    "SELECT user_id, transaction_count, centroid_sum FROM profiles "
+                    f"WHERE user_id IN ({', '.join('?' * len(batch))})",
+                    batch
+                ):
+                    if count and centroid_sum:
+                        found.append(user_id)
+                        rows.append(np.frombuffer(centroid_sum, dtype=np.float32) / count)
+        matrix = np.vstack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+        return found, matrix
+
+    def delete_users(self, user_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.db.executemany("DELETE FROM profiles WHERE user_id = ?", [(uid,) for uid in user_ids])
+            self.db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def rebuild_users(self, user_ids: Iterable[str], user_index: UserIndex, collection) -> None:
+        """
+        Recompute the given users' profiles from scratch from the user index
+        and the transaction embeddings stored in 'collection'. Used after
+        transactions were changed or deleted.
+        """
+        user_ids = list(user_ids)
+        self.delete_users(user_ids)
+        for user_id in user_ids:
+            transactions = user_index.transactions(user_id)
+            if not transactions:
+                continue
+            stored = collection.get(ids=[txn["record_id"] for txn in transactions], include=["embeddings"])
+            embeddings = dict(zip(stored["ids"], stored["embeddings"]))
+            self.add_transactions((txn, embeddings.get(txn["record_id"])) for txn in transactions)
+
+    def rebuild(self, collection, page_size: int = 5000) -> None:
+        """Re-create every profile from the transactions stored in 'collection'."""
+        with self._lock:
+            self.db.execute("DELETE FROM profiles")
+            self.db.commit()
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"record_type": "transaction"},
+                include=["metadatas", "embeddings"],
+                limit=page_size,
+                offset=offset
+            )
+            if not page["ids"]:
+                break
+            self.add_transactions(zip(page["metadatas"], page["embeddings"]))
+            offset += len(page["ids"])
+
+
+CATALOG_VERSION_KEY = "catalog"
+
+
+class IndexVersions:
+    """
+    Monotonic version counters, bumped by embedding.py whenever a user's
+    transactions or the offer/strategy catalog change. Readers fold them
+    into cache keys, so cached results go stale across processes without
+    any explicit invalidation message.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        self.db.commit()
+
+    def _bump(self, keys: Iterable[str]) -> None:
+        rows = [(key,) for key in set(keys)]
+        if not rows:
+            return
+        with self._lock:
+            self.db.executemany(
+                "INSERT INTO versions (key, version) VALUES (?, 1) "
+                "ON CONFLICT(key) DO UPDATE SET version = version + 1",
+                rows
+            )
+            self.db.commit()
+
+    def bump_users(self, user_ids: Iterable[str]) -> None:
+        self._bump(f"user:{user_id}" for user_id in user_ids)
+
+    def bump_catalog(self) -> None:
+        self._bump([CATALOG_VERSION_KEY])
+
+    def bump_partitions(self, record_types: Iterable[str]) -> None:
+        self._bump(f"partition:{record_type}" for record_type in record_types)
+
+    def partition_version(self, record_type: str) -> int:
+        """Version of one record-type partition, used to refresh in-memory copies."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT version FROM versions WHERE key = ?", (f"partition:{record_type}",)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def get(self, user_id: str) -> Tuple[int, int]:
+        """Return (user version, catalog version); 0 if never bumped."""
+        with self._lock:
+            versions = dict(self.db.execute(
+                "SELECT key, version FROM versions WHERE key IN (?, ?)",
+                (f"user:{user_id}", CATALOG_VERSION_KEY)
+            ).fetchall())
+        return versions.get(f"user:{user_id}", 0), versions.get(CATALOG_VERSION_KEY, 0)
+
+
+OFFER_COLUMNS = ("record_id", "valid_from", "valid_until", "minimum_transaction_amount",
+                 "spending_threshold", "risk_profile")
+
+
+class OfferEligibility:
+    """
+    Structured offer constraints kept in SQLite: the validity interval,
+    minimum transaction amount, user spending threshold and targeted risk
+    profile. The interval and the two amounts are indexed, so the offers a
+    user is eligible for can be found with range scans before any vector
+    scoring. Built from offer metadata at ingest time.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS offer_eligibility ("
+            "record_id TEXT PRIMARY KEY, valid_from TEXT, valid_until TEXT, "
+            "minimum_transaction_amount REAL, spending_threshold REAL, risk_profile TEXT)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS offer_eligibility_validity ON offer_eligibility (valid_until, valid_from)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS offer_eligibility_amounts "
+            "ON offer_eligibility (minimum_transaction_amount, spending_threshold)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def _row(record_id: str, metadata: Dict[str, Any]) -> Tuple:
+        return (
+            record_id,
+            metadata.get("valid_from", ""),
+            metadata.get("valid_until", ""),
+            metadata.get("minimum_transaction_amount", 0) or 0,
+            metadata.get("spending_threshold", 0) or 0,
+            metadata.get("risk_profile", ""),
+        )
+
+    def upsert(self, records: Iterable[Tuple[str, Dict[str, Any]]]) -> int:
+        """Insert or replace (record id, metadata) pairs; non-offers are ignored."""
+        rows = [
+            self._row(record_id, metadata)
+            for record_id, metadata in records
+            if metadata.get("record_type") == "offer"
+        ]
+        if rows:
+            with self._lock:
+                self.db.executemany(
+                    f"INSERT OR REPLACE INTO offer_eligibility ({', '.join(OFFER_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(OFFER_COLUMNS))})",
+                    rows
+                )
+                self.db.commit()
+        return len(rows)
+
+    def delete(self, record_ids: Iterable[str]) -> None:
+        with self._lock:
+            self.db.executemany("DELETE FROM offer_eligibility WHERE record_id = ?", [(rid,) for rid in record_ids])
+            self.db.commit()
+
+    def eligible(self, at: str, largest_amount: Optional[float] = None, total_spend: Optional[float] = None,
+                 risk_profile: Optional[str] = None) -> List[str]:
+        """
+        Return the IDs of offers valid at 'at' (ISO-8601) that the user
+        qualifies for: a transaction as large as the offer's minimum, total
+        spend at or above its threshold and, if given, a matching risk
+        profile. Constraints passed as None are not applied, and offers
+        without a date or risk profile are not restricted by it.
+        """
+        query = (
+            "SELECT record_id FROM offer_eligibility "
+            "WHERE (valid_until = '' OR valid_until >= ?) AND (valid_from = '' OR valid_from <= ?)"
+        )
+        params: List[Any] = [at, at]
+        if largest_amount is not None:
+            query += " AND minimum_transaction_amount <= ?"
+            params.append(largest_amount)
+        if total_spend is not None:
+            query += " AND spending_threshold <= ?"
+            params.append(total_spend)
+        if risk_profile:
+            query += " AND (risk_profile = '' OR risk_profile = ?)"
+            params.append(risk_profile)
+        with self._lock:
+            return [row[0] for row in self.db.execute(query, params).fetchall()]
+
+    def amounts(self, record_ids: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """The minimum transaction amounts and spending thresholds of 'record_ids', in that order."""
+        record_ids = list(record_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(record_ids), 500):
+                batch = record_ids[i:i + 500]
+                for record_id, minimum, threshold in self.db.execute(
+                    "SELECT record_id, minimum_transaction_amount, spending_threshold FROM offer_eligibility "
+                    f"WHERE record_id IN ({', '.join('?' * len(batch))})",
+                    batch
+                ):
+                    found[record_id] = (minimum or 0.0, threshold or 0.0)
+        rows = [found.get(record_id, (0.0, 0.0)) for record_id in record_ids]
+        minimums = np.asarray([row[0] for row in rows], dtype=np.float64)
+        thresholds = np.asarray([row[1] for row in rows], dtype=np.float64)
+        return minimums, thresholds
+
+    def count(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM offer_eligibility").fetchone()[0]
+
+    def rebuild(self, collection, page_size: int = 5000) -> int:
+        """Re-create the table from the offer metadata in a Chroma collection."""
+        with self._lock:
+            self.db.execute("DELETE FROM offer_eligibility")
+            self.db.commit()
+        total = 0
+        offset = 0
+        while True:
+            page = collection.get(
+                where={"record_type": "offer"},
+                include=["metadatas"],
+                limit=page_size,
+                offset=offset
+            )
+            if not page["ids"]:
+                break
+            total += self.upsert(zip(page["ids"], page["metadatas"]))
+            offset += len(page["ids"])
+        return total